@@ -0,0 +1,115 @@
+"""This file generates dungeons in bulk, for content review and balance
+testing, without starting a game. Maps are generated across a pool of
+worker processes and streamed to a single file as they finish:
+
+    python ex45_batch.py maps.bin 50 --seeds 0-9999
+    python ex45_batch.py maps.bin 500 --seeds 0-999 --batch-types
+
+Each record in the output file is a BATCH_RECORD (seed, length)
+followed by length bytes of ex45_map.encode_map() output.
+"""
+
+import argparse
+import struct
+from multiprocessing import Pool
+from ex45_engines import RoomEngine
+from ex45_map import build_map, encode_map
+
+
+BATCH_RECORD = struct.Struct('<qI')
+
+
+def generate_dungeon(size, seed, batch_types=False):
+    """Generates one dungeon map from a seed and returns it encoded.
+    With batch_types, room types are picked all at once, as
+    RoomEngine.batch_room_types describes.
+    """
+
+    room_map = RoomEngine(size, 'sparse', seed)
+    room_map.batch_room_types = batch_types
+    return encode_map(build_map(room_map))
+
+
+def _generate(job):
+    # Pool workers take a single argument.
+    (size, seed, batch_types) = job
+    return seed, generate_dungeon(size, seed, batch_types)
+
+
+def generate_batch(out_file, size, seeds, processes=None, chunksize=16,
+                   batch_types=False):
+    """Generates a dungeon for each seed and writes them to out_file.
+
+    Maps are written in seed order as soon as they are ready, so only
+    a few chunks of maps are ever held in memory at once. processes
+    defaults to the number of CPUs. Returns the number of maps
+    written.
+    """
+
+    jobs = ((size, seed, batch_types) for seed in seeds)
+    count = 0
+    pool = Pool(processes)
+    try:
+        for seed, data in pool.imap(_generate, jobs, chunksize):
+            out_file.write(BATCH_RECORD.pack(seed, len(data)))
+            out_file.write(data)
+            count += 1
+    finally:
+        pool.terminate()
+        pool.join()
+    return count
+
+
+def read_batch(in_file):
+    """Yields (seed, encoded map) pairs from a file of batch records."""
+
+    while True:
+        header = in_file.read(BATCH_RECORD.size)
+        if not header:
+            return
+        (seed, length) = BATCH_RECORD.unpack(header)
+        yield seed, in_file.read(length)
+
+
+def parse_seeds(text):
+    """Turns '7', '0-99' or '1,5,9' into a list of seeds.
+
+    Negative seeds are refused: random.Random seeds itself with a
+    seed's absolute value, so they would only repeat other maps.
+    """
+
+    seeds = []
+    for part in text.split(','):
+        (first, dash, last) = part.partition('-')
+        if part.lstrip().startswith('-') or last.lstrip().startswith('-'):
+            raise argparse.ArgumentTypeError(
+                "seeds cannot be negative: %r" % part)
+        if dash:
+            seeds.extend(range(int(first), int(last) + 1))
+        else:
+            seeds.append(int(part))
+    return seeds
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Generate dungeon maps in bulk.")
+    parser.add_argument('out', help="file to write the maps to")
+    parser.add_argument('size', type=int, help="width of the square map")
+    parser.add_argument('--seeds', type=parse_seeds, default='0-999',
+                        help="seeds to generate, e.g. 0-999 or 1,5,9")
+    parser.add_argument('--processes', type=int, default=None,
+                        help="worker processes (default: one per CPU)")
+    parser.add_argument('--batch-types', action='store_true',
+                        help="pick every room's type at once; the same "
+                             "seed then gives a different map")
+    args = parser.parse_args()
+
+    with open(args.out, 'wb') as out_file:
+        count = generate_batch(out_file, args.size, args.seeds,
+                               args.processes, batch_types=args.batch_types)
+    print "Wrote %d maps to %s" % (count, args.out)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,456 @@
+"""This file contains benchmarks for the map generator and game engines
+of ex45_main.py. Run it directly, naming the benchmark to run:
+
+    python ex45_bench.py generate [size ...]
+    python ex45_bench.py batch [processes ...]
+    python ex45_bench.py pick [count ...]
+    python ex45_bench.py render [size ...]
+    python ex45_bench.py fight [mob size ...]
+    python ex45_bench.py play [moves ...]
+    python ex45_bench.py save [size ...]
+    python ex45_bench.py memory [size ...]
+    python ex45_bench.py monsters [count ...]
+    python ex45_bench.py descend [size ...]
+    python ex45_bench.py startup [runs ...]
+"""
+
+import sys
+from sys import argv
+import os
+import time
+import random
+import bisect
+import cPickle
+import tempfile
+import resource
+import subprocess
+from multiprocessing import cpu_count, Pool
+from ex45_engines import RoomEngine, GameEngine
+from ex45_map import create_map, seed_map, generate_map, build_map
+from ex45_map import draw_map, MapRenderer
+from ex45_batch import generate_batch
+from ex45_engines import FightEngine
+from ex45_chars import Hero, GenericMonster, MonsterStore
+from ex45_chars import populate_map
+from ex45_text import TerminalOutput, ScriptedInput, NullOutput
+from ex45_save import save_game, load_game
+from ex45_levels import LevelLoader
+from ex45_rooms import DESCEND
+
+
+def bench_generate(sizes=(10, 100, 250, 500, 1000, 2000)):
+    """Times map generation for increasingly large maps.
+
+    For each size a blank map is created and seeded, then only
+    generate_map() is timed. Room generation itself is linear in
+    the number of rooms; what remains proportional to the map area
+    is the final fill_empty_rooms() pass, so time per cell is shown
+    as well.
+    """
+
+    print "%8s %10s %10s %12s %12s" % ('size', 'rooms', 'seconds',
+        'us/room', 'ns/cell')
+    for size in sizes:
+        room_map = RoomEngine(size)
+        room_map = create_map(room_map)
+        room_map = seed_map(room_map)
+
+        start = time.time()
+        room_map = generate_map(room_map)
+        elapsed = time.time() - start
+
+        rooms = len([room for room in room_map.rooms.values()
+                     if room.real])
+        print "%8d %10d %10.3f %12.2f %12.2f" % (size, rooms, elapsed,
+            elapsed / rooms * 1e6, elapsed / size ** 2 * 1e9)
+
+
+def bench_batch(processes=None, size=50, maps=2000):
+    """Measures batch generation throughput in maps per second.
+
+    The same batch of maps is generated with each number of worker
+    processes, by default one up to the number of CPUs, and written
+    to the null device. Throughput should grow close to linearly with
+    the number of processes, up to the number of cores.
+    """
+
+    if processes is None:
+        processes = range(1, cpu_count() + 1)
+
+    print "%10s %10s %10s %10s" % ('processes', 'maps', 'seconds', 'maps/sec')
+    for count in processes:
+        with open(os.devnull, 'wb') as out_file:
+            start = time.time()
+            generate_batch(out_file, size, range(maps), count)
+            elapsed = time.time() - start
+        print "%10d %10d %10.3f %10.1f" % (count, maps, elapsed,
+            maps / elapsed)
+
+
+def _rebuilt_pick_random_room(room_map):
+    # The room type picker as it was before its weights were
+    # compiled once per engine, kept for comparison.
+    values, weights = zip(*room_map._standard_rooms)
+    total_weight = 0
+    cum_weights = []
+    for weight in weights:
+        total_weight += weight
+        cum_weights.append(total_weight)
+    random_point = room_map.random.random() * total_weight
+    j = bisect.bisect(cum_weights, random_point)
+    return values[j]
+
+
+def bench_pick(counts=(1000, 100000, 1000000)):
+    """Times room type picks, in nanoseconds per pick.
+
+    Compares rebuilding the weight table on every pick with the
+    compiled table, one pick at a time and in a single batch.
+    """
+
+    room_map = RoomEngine(10, seed=0)
+    room_map._pick_random_rooms(1)     # Import NumPy up front.
+    print "%10s %12s %12s %12s" % ('picks', 'rebuilt', 'compiled', 'batch')
+    for count in counts:
+        timings = []
+        for pick in (_rebuilt_pick_random_room,
+                     RoomEngine._pick_random_room):
+            start = time.time()
+            for i in xrange(count):
+                pick(room_map)
+            timings.append(time.time() - start)
+
+        start = time.time()
+        room_map._pick_random_rooms(count)
+        timings.append(time.time() - start)
+
+        print "%10d %12.1f %12.1f %12.1f" % tuple([count] +
+            [timing / count * 1e9 for timing in timings])
+
+
+def bench_render(sizes=(20, 100, 300), moves=10):
+    """Times drawing the map after a move, in milliseconds per move.
+
+    Compares writing the whole map with draw_map() against redrawing
+    the window around the hero with MapRenderer. Output goes to the
+    null device.
+    """
+
+    print "%8s %12s %12s" % ('size', 'draw_map', 'renderer')
+    with open(os.devnull, 'w') as null:
+        out = TerminalOutput(null)
+        for size in sizes:
+            room_map = build_map(RoomEngine(size, 'compact', seed=0))
+            room_map.coord = room_map.init_coord
+            renderer = MapRenderer(room_map)
+            renderer.render()
+
+            start = time.time()
+            for i in range(moves):
+                draw_map(room_map, out)
+                out.flush()
+            full = time.time() - start
+
+            start = time.time()
+            for i in range(moves):
+                renderer.mark(room_map.coord)
+                renderer.draw(out)
+                out.flush()
+            window = time.time() - start
+
+            print "%8d %12.3f %12.3f" % (size, full / moves * 1e3,
+                window / moves * 1e3)
+
+
+def bench_fight(mob_sizes=(1, 3, 10, 30), fights=2000):
+    """Measures auto-resolved fights per second for each mob size."""
+
+    print "%8s %10s %10s %12s" % ('mob', 'fights', 'won', 'fights/sec')
+    for mob_size in mob_sizes:
+        won = 0
+        start = time.time()
+        for i in xrange(fights):
+            monsters = [GenericMonster(j) for j in range(mob_size)]
+            outcome = FightEngine.battle(Hero(), monsters, quiet=True)
+            won += outcome.survivor == 'hero'
+        elapsed = time.time() - start
+        print "%8d %10d %10d %12.0f" % (mob_size, fights, won,
+            fights / elapsed)
+
+
+def bench_play(counts=(10000, 100000), size=40):
+    """Measures headless play in moves per second.
+
+    A scripted player wanders a populated dungeon, fleeing every
+    fight, with all output thrown away. Each run stops when the
+    script runs out or the hero finds the last room.
+    """
+
+    print "%10s %10s %12s" % ('moves', 'played', 'moves/sec')
+    for count in counts:
+        rng = random.Random(count)
+        moves = ['0', '1', '2', '3', 'flee']
+        script = [rng.choice(moves) for i in xrange(count)]
+        source = ScriptedInput(script)
+        room_map = populate_map(build_map(RoomEngine(size, 'sparse', 0)))
+        game = GameEngine(source, NullOutput())
+
+        start = time.time()
+        try:
+            game.start(room_map)
+        except SystemExit:
+            pass
+        elapsed = time.time() - start
+        played = count - sum(1 for line in source._lines)
+        print "%10d %10d %12.0f" % (count, played, played / elapsed)
+
+
+def bench_save(sizes=(100, 300, 1000)):
+    """Compares snapshots with pickles of a populated dungeon.
+
+    Shows the size of each file, the time to save and to resume, and
+    the time to generate the same compact dungeon from scratch. The
+    pickle holds the rooms as a plain dict, as the dict backend does.
+    Resuming a snapshot only reads its header and the rooms around the
+    hero.
+    """
+
+    print "%6s %8s %10s %10s %8s %8s %8s %8s %8s" % ('size', 'rooms',
+        'snap KB', 'pickle KB', 'gen s', 'save s', 'load s', 'dump s',
+        'unpick s')
+    directory = tempfile.mkdtemp()
+    snapshot_path = os.path.join(directory, 'game.sav')
+    pickle_path = os.path.join(directory, 'game.pickle')
+    try:
+        for size in sizes:
+            start = time.time()
+            room_map = populate_map(build_map(RoomEngine(size, 'compact',
+                                                         15)))
+            generate = time.time() - start
+            room_map.coord = room_map.init_coord
+            hero = Hero()
+            rooms = sum(1 for coord, room in room_map.rooms.iteritems()
+                        if room.real)
+
+            start = time.time()
+            save_game(snapshot_path, room_map, hero)
+            save = time.time() - start
+
+            start = time.time()
+            (loaded, hero) = load_game(snapshot_path)
+            MapRenderer(loaded).render()
+            load = time.time() - start
+
+            start = time.time()
+            with open(pickle_path, 'wb') as pickle_file:
+                cPickle.dump((dict(room_map.rooms), room_map.coord,
+                              room_map.init_coord, hero), pickle_file,
+                             cPickle.HIGHEST_PROTOCOL)
+            dump = time.time() - start
+
+            start = time.time()
+            with open(pickle_path, 'rb') as pickle_file:
+                cPickle.load(pickle_file)
+            unpickle = time.time() - start
+
+            print "%6d %8d %10.1f %10.1f %8.3f %8.3f %8.3f %8.3f %8.3f" % (
+                size, rooms, os.path.getsize(snapshot_path) / 1024.0,
+                os.path.getsize(pickle_path) / 1024.0, generate, save, load,
+                dump, unpickle)
+    finally:
+        for path in (snapshot_path, pickle_path):
+            if os.path.exists(path):
+                os.remove(path)
+        os.rmdir(directory)
+
+
+def _map_memory(size, backend):
+    # Runs in a fresh worker, so the rise in its peak memory is all
+    # down to the map.
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    room_map = populate_map(build_map(RoomEngine(size, backend, 15)))
+    after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return (after - before) * 1024.0 / size ** 2
+
+
+def bench_memory(sizes=(1000,)):
+    """Measures the memory a populated map takes, in bytes per cell.
+
+    Each map is built in a fresh worker process, and the rise in the
+    worker's peak memory is divided by the number of cells.
+    """
+
+    print "%8s %12s %12s %12s" % ('size', 'dict', 'compact', 'sparse')
+    for size in sizes:
+        per_cell = []
+        for backend in ('dict', 'compact', 'sparse'):
+            pool = Pool(1)
+            try:
+                per_cell.append(pool.apply(_map_memory, (size, backend)))
+            finally:
+                pool.terminate()
+                pool.join()
+        print "%8d %12.2f %12.2f %12.2f" % tuple([size] + per_cell)
+
+
+def bench_monsters(counts=(10000, 100000, 1000000)):
+    """Compares monsters as objects with monsters in a MonsterStore.
+
+    Times creating count monsters three to a room, a regeneration
+    tick and a difficulty scaling over all of them, and finding the
+    monsters of one room, which for objects means a scan of them all.
+    The first regeneration tick of the store includes importing NumPy.
+    """
+
+    print "%10s %8s %10s %10s %10s %10s" % ('monsters', 'kind', 'create s',
+        'regen s', 'scale s', 'room s')
+    for count in counts:
+        rooms = count // 3
+
+        start = time.time()
+        monsters = [GenericMonster(i % 3) for i in xrange(rooms * 3)]
+        homes = [i // 3 for i in xrange(rooms * 3)]
+        create = time.time() - start
+        start = time.time()
+        for monster in monsters:
+            monster.hit_points = min(monster.hit_points + 1, 10)
+        regenerate = time.time() - start
+        start = time.time()
+        for monster in monsters:
+            monster.hit_points = int(monster.hit_points * 1.5 + 0.5)
+            monster.attack = tuple(int(value * 1.5 + 0.5)
+                                   for value in monster.attack)
+        scale = time.time() - start
+        start = time.time()
+        found = [monster for monster, home in zip(monsters, homes)
+                 if home == rooms // 2]
+        room = time.time() - start
+        print "%10d %8s %10.3f %10.3f %10.3f %10.4f" % (count, 'objects',
+            create, regenerate, scale, room)
+        del monsters, homes, found
+
+        start = time.time()
+        store = MonsterStore()
+        store.allocate(range(rooms), [3] * rooms)
+        create = time.time() - start
+        start = time.time()
+        store.regenerate(1)
+        regenerate = time.time() - start
+        start = time.time()
+        store.scale(1.5)
+        scale = time.time() - start
+        start = time.time()
+        store.in_room(rooms // 2)
+        room = time.time() - start
+        print "%10d %8s %10.3f %10.3f %10.3f %10.4f" % (count, 'store',
+            create, regenerate, scale, room)
+
+
+def bench_descend(sizes=(100, 300, 1000), levels=5):
+    """Measures how long the hero waits to reach each new level.
+
+    A game starting at each size descends levels times, with and
+    without the next level built in the background. The hero spends
+    a second on each level, standing in for play.
+    """
+
+    print "%8s %12s %12s %12s" % ('size', 'background', 'wait ms',
+                                  'worst ms')
+    for size in sizes:
+        for background in (True, False):
+            loader = LevelLoader(size, 'sparse', 15, background=background)
+            game = GameEngine(ScriptedInput([]), NullOutput(), loader)
+            game.setup(loader.build(1))
+            waits = []
+            for i in xrange(levels):
+                time.sleep(1)
+                start = time.time()
+                game.step(DESCEND)
+                waits.append(time.time() - start)
+            print "%8d %12s %12.1f %12.1f" % (size, background,
+                sum(waits) / levels * 1e3, max(waits) * 1e3)
+
+
+# What each kind of cold start runs, and the most it may add to the
+# start of a bare interpreter, in milliseconds.
+STARTUP_BUDGETS = (
+    ('headless', 'import ex45_engines; ex45_engines.RoomEngine(10)', 20),
+    ('main', 'import ex45_main', 35))
+
+# Modules a headless start must leave for later.
+LAZY_MODULES = ('readline', 'pprint', 'textwrap', 'threading', 'json',
+                'cPickle', 'ex45_odds', 'numpy')
+
+
+# Cold starts run here, so that they find the game's modules.
+_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+
+def _start_time(code, runs):
+    # The best of runs cold starts of a fresh interpreter running code.
+    best = None
+    for i in xrange(runs):
+        start = time.time()
+        subprocess.check_call([sys.executable, '-c', code], cwd=_DIRECTORY)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def bench_startup(runs=(20,)):
+    """Measures how long a fresh process takes to be ready.
+
+    Each kind of start in STARTUP_BUDGETS is timed over and above a
+    bare interpreter, keeping the best of runs starts, and checked
+    against its budget. A headless start must not load any of
+    LAZY_MODULES. Exits with status 1 if any check fails, so that
+    slower starts are caught before they reach the batch workers.
+    """
+
+    failed = False
+    print "%10s %6s %10s %10s" % ('start', 'runs', 'ms', 'budget ms')
+    for count in runs:
+        bare = _start_time('pass', count)
+        for name, code, budget in STARTUP_BUDGETS:
+            extra = (_start_time(code, count) - bare) * 1e3
+            over = extra > budget
+            failed = failed or over
+            print "%10s %6d %10.1f %10d%s" % (name, count, extra, budget,
+                '  OVER BUDGET' if over else '')
+
+    loaded = subprocess.check_output([sys.executable, '-c',
+        STARTUP_BUDGETS[0][1] + "; import sys; print ' '.join(sys.modules)"],
+        cwd=_DIRECTORY)
+    eager = sorted(set(loaded.split()) & set(LAZY_MODULES))
+    if eager:
+        failed = True
+        print "Loaded by a headless start:", ' '.join(eager)
+    if failed:
+        sys.exit(1)
+
+
+def main():
+    """Runs the benchmark named on the command line."""
+
+    benchmarks = {'generate': bench_generate,
+                  'batch': bench_batch,
+                  'pick': bench_pick,
+                  'render': bench_render,
+                  'fight': bench_fight,
+                  'play': bench_play,
+                  'save': bench_save,
+                  'memory': bench_memory,
+                  'monsters': bench_monsters,
+                  'descend': bench_descend,
+                  'startup': bench_startup}
+
+    name = argv[1] if len(argv) > 1 else 'generate'
+    sizes = [int(size) for size in argv[2:]]
+    if sizes:
+        benchmarks[name](sizes)
+    else:
+        benchmarks[name]()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""This file contains an on-disk cache of generated maps, so that a
+map built from the same size, seed and generation knobs never has to
+be generated twice.
+"""
+
+import os
+import cPickle
+from ex45_map import GENERATOR_VERSION, encode_map, load_map
+
+
+class MapCache(object):
+    """Keeps generated maps on disk, keyed by size, seed, the room
+    engine's min_rooms, room_chance and batch_room_types knobs, and
+    the generator version.
+
+    Each entry holds the encoded map along with the state its room
+    engine's random number generator was left in, so a cached map
+    goes on to be populated exactly as a freshly generated one would.
+    Entries are files in directory. Once they take up more than
+    max_bytes, the least recently used ones are deleted.
+    """
+
+    def __init__(self, directory='.ex45_cache', max_bytes=64 * 1024 ** 2):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def _path(self, room_map):
+        # Every knob that changes the generated map is in the name.
+        name = "map-%d-%d-r%d-p%r%s-v%d.bin" % (room_map.size,
+            room_map.seed, room_map.min_rooms, room_map.room_chance,
+            '-batch' if room_map.batch_room_types else '',
+            GENERATOR_VERSION)
+        return os.path.join(self.directory, name)
+
+    def load(self, room_map):
+        """Loads the cached map for room_map's size, seed and knobs
+        into it.
+
+        Returns True on a hit and False on a miss. Maps without a
+        seed are never cached.
+        """
+
+        if room_map.seed is None:
+            return False
+
+        path = self._path(room_map)
+        try:
+            with open(path, 'rb') as cache_file:
+                (data, state) = cPickle.load(cache_file)
+        except IOError:
+            return False
+        except (EOFError, ValueError, cPickle.UnpicklingError):
+            # A damaged entry is dropped and regenerated.
+            os.remove(path)
+            return False
+
+        load_map(room_map, data)
+        room_map.random.setstate(state)
+
+        # Mark the entry as recently used.
+        os.utime(path, None)
+        return True
+
+    def save(self, room_map):
+        """Adds a freshly generated map to the cache."""
+
+        if room_map.seed is None:
+            return
+
+        path = self._path(room_map)
+        entry = (encode_map(room_map), room_map.random.getstate())
+
+        # Write to a temporary file first so that other processes
+        # never see a half-written entry.
+        temp_path = "%s.%d.tmp" % (path, os.getpid())
+        with open(temp_path, 'wb') as cache_file:
+            cPickle.dump(entry, cache_file, cPickle.HIGHEST_PROTOCOL)
+        os.rename(temp_path, path)
+
+        self.evict()
+
+    def evict(self):
+        """Deletes least recently used entries until the cache fits
+        in max_bytes.
+        """
+
+        entries = []
+        total = 0
+        for name in os.listdir(self.directory):
+            if not name.endswith('.bin'):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+
+        entries.sort()
+        while total > self.max_bytes and entries:
+            (mtime, size, path) = entries.pop(0)
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
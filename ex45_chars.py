@@ -2,12 +2,16 @@
 well as item/weapon/armor information.
 """
 
-import random
+import math
+from array import array
+import ex45_grid
 
 
 class Being(object):
     """This is the parent class for both hero and monsters."""
 
+    __slots__ = ()
+
     def __init__(self):
     # Do I really need this super class?
         pass
@@ -36,12 +40,13 @@ class Hero(Being):
                   'leather': (15, 30)
                   }
 
-    direction = 0
+    __slots__ = ('basic_attack', 'hit_points', 'attack', 'direction')
 
     def __init__(self):
         super(Hero, self).__init__()
         self.basic_attack = (5,10)
         self.hit_points = 100
+        self.direction = 0
         #~ self.weapon_attack = self.item_stats['dagger']
         #~ self.total_attack = self.basic_attack + self.weapon_attack
         self.attack = self.basic_attack
@@ -56,29 +61,216 @@ class GenericMonster(Being):
     Change this to something more interesting later.
     """
 
+    __slots__ = ('attack', 'hit_points', 'number')
+
+    # The hit points a monster starts with.
+    max_hit_points = 10
+
     def __init__(self, number):
         super(GenericMonster, self).__init__()
         self.attack = (2,5)
-        self.hit_points = 10
+        self.hit_points = self.max_hit_points
         self.number = str(number + 1)
 
     def __repr__(self):
         return " ".join(('generic monster', self.number))
 
 
+class MonsterView(Being):
+    """A monster kept in a MonsterStore.
+
+    Views hold nothing but the store and the monster's place in it,
+    and read and write its stats there, so they can stand in for a
+    GenericMonster in a room's monsters list and in fights.
+    """
+
+    __slots__ = ('store', 'index')
+
+    def __init__(self, store, index):
+        self.store = store
+        self.index = index
+
+    @property
+    def attack(self):
+        return (self.store.attack_low[self.index],
+                self.store.attack_high[self.index])
+
+    @property
+    def hit_points(self):
+        return self.store.hit_points[self.index]
+
+    @hit_points.setter
+    def hit_points(self, hit_points):
+        self.store.hit_points[self.index] = hit_points
+        if hit_points <= 0:
+            self.store.alive[self.index] = 0
+
+    @property
+    def max_hit_points(self):
+        return self.store.max_hit_points[self.index]
+
+    @property
+    def number(self):
+        return str(self.store.numbers[self.index])
+
+    def __repr__(self):
+        return " ".join(('generic monster', self.number))
+
+
+class MonsterStore(object):
+    """Every monster of a map, as parallel arrays.
+
+    Monster i has attack range (attack_low[i], attack_high[i]),
+    hit_points[i] out of max_hit_points[i], is in the room at cell
+    index rooms[i] (y * size + x), is numbered numbers[i] within its
+    room and is alive while alive[i] is 1. Monsters are added in bulk
+    with allocate() and handed out as MonsterViews. Bulk operations
+    are vectorized when NumPy is installed, and fall back to plain
+    loops when it is not.
+    """
+
+    def __init__(self):
+        self.attack_low = array('i')
+        self.attack_high = array('i')
+        self.hit_points = array('i')
+        self.max_hit_points = array('i')
+        self.rooms = array('l')
+        self.numbers = array('i')
+        self.alive = array('b')
+
+    def __len__(self):
+        return len(self.alive)
+
+    def allocate(self, rooms, counts, attack=(2, 5), hit_points=10):
+        """Adds counts[i] monsters to the room at cell index rooms[i],
+        numbered from 1 in each room. Returns the index of the first
+        new monster.
+        """
+
+        first = len(self)
+        total = sum(counts)
+        self.attack_low.extend(array('i', [attack[0]]) * total)
+        self.attack_high.extend(array('i', [attack[1]]) * total)
+        self.hit_points.extend(array('i', [hit_points]) * total)
+        self.max_hit_points.extend(array('i', [hit_points]) * total)
+        self.alive.extend(array('b', [1]) * total)
+        for room, count in zip(rooms, counts):
+            self.rooms.extend(array('l', [room]) * count)
+            self.numbers.extend(array('i', range(1, count + 1)))
+        return first
+
+    def views(self, first, count):
+        """Returns views of count monsters from index first."""
+
+        return [MonsterView(self, i) for i in xrange(first, first + count)]
+
+    def _numpy(self):
+        # Returns NumPy and the store's arrays as NumPy arrays sharing
+        # their memory, or (None, None) without NumPy.
+        try:
+            import numpy
+        except ImportError:
+            return None, None
+
+        arrays = {}
+        for name, dtype in (('attack_low', numpy.intc),
+                            ('attack_high', numpy.intc),
+                            ('hit_points', numpy.intc),
+                            ('max_hit_points', numpy.intc),
+                            ('rooms', numpy.int_),
+                            ('alive', numpy.int8)):
+            arrays[name] = numpy.frombuffer(getattr(self, name), dtype)
+        return numpy, arrays
+
+    def in_room(self, room):
+        """Returns views of the living monsters in the room at cell
+        index room.
+        """
+
+        (numpy, arrays) = self._numpy()
+        if numpy is None:
+            indices = [i for i in xrange(len(self))
+                       if self.rooms[i] == room and self.alive[i]]
+        else:
+            indices = numpy.flatnonzero((arrays['rooms'] == room) &
+                                        (arrays['alive'] == 1))
+        return [MonsterView(self, i) for i in indices]
+
+    def regenerate(self, amount):
+        """Heals every living monster by amount, up to its maximum."""
+
+        (numpy, arrays) = self._numpy()
+        if numpy is None:
+            for i in xrange(len(self)):
+                if self.alive[i]:
+                    self.hit_points[i] = min(self.hit_points[i] + amount,
+                                             self.max_hit_points[i])
+            return
+
+        living = arrays['alive'] == 1
+        hit_points = arrays['hit_points']
+        hit_points[living] = numpy.minimum(hit_points[living] + amount,
+                                           arrays['max_hit_points'][living])
+
+    def scale(self, factor):
+        """Multiplies the hit points and attack of every living monster
+        by factor, rounding halves up, to make them harder or easier.
+        """
+
+        names = ('attack_low', 'attack_high', 'hit_points', 'max_hit_points')
+        (numpy, arrays) = self._numpy()
+        if numpy is None:
+            for i in xrange(len(self)):
+                if self.alive[i]:
+                    for name in names:
+                        values = getattr(self, name)
+                        values[i] = int(math.floor(values[i] * factor + 0.5))
+            return
+
+        living = arrays['alive'] == 1
+        for name in names:
+            values = arrays[name]
+            values[living] = numpy.floor(values[living] * factor + 0.5)
+
+
 def populate_map(room_map):
     """Places monsters in rooms on the map.
 
     Given a room_map object containing a dictionary of rooms, this
     function randomly places 1-3 monsters in all rooms except for the
-    first, last and healing rooms. The monsters are stored in a list
-    in each Room() object.
+    first, last, healing and tomb rooms, and a mummy in each tomb
+    room. The monsters are kept in the room_map's monster_store,
+    which is allocated in one go, and a list of views of them in each
+    Room() object. Only real rooms are looked at. Random choices come
+    from the room_map's own random number generator.
     """
 
-    for room in room_map.rooms:
-        if room_map.rooms[room].other_enemies == 'no':
+    # Rooms are visited in cell order, not in the order the map's
+    # backend stores them, so a seed places the same monsters whichever
+    # backend holds the map.
+    cells = sorted((y * room_map.size + x, (x, y))
+                   for (x, y), cell in ex45_grid.real_cells(room_map))
+
+    rooms = []
+    indices = []
+    counts = []
+    for index, coord in cells:
+        room = room_map.rooms[coord]
+        if room.room_type == 'TombRoom':
+            # The mummy waits in its sarcophagus. It is kept in the
+            # store with the rest, so deeper levels make it tougher.
+            count = 1
+        elif room.other_enemies == 'no':
             continue
-        num_monsters = random.randint(1, 3)
-        for i in range(0, num_monsters):
-            room_map.rooms[room].monsters.append(GenericMonster(i))
+        else:
+            count = room_map.random.randint(1, 3)
+        rooms.append(room)
+        indices.append(index)
+        counts.append(count)
+
+    store = room_map.monster_store
+    first = store.allocate(indices, counts)
+    for room, count in zip(rooms, counts):
+        room.monsters.extend(store.views(first, count))
+        first += count
     return room_map
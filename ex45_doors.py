@@ -0,0 +1,134 @@
+"""This file holds the doors of a whole map as a NumPy array, so that
+maps can be checked and measured in array time rather than one room at
+a time. It needs NumPy, which the game itself does not.
+
+The door array is a (size, size) uint8 array indexed [y, x]. Each
+entry is a room's door mask, as in ex45_grid.door_mask(): bit i is set
+when the room has a door in direction i (0 north, 1 east, 2 south,
+3 west). Cells without a room are 0.
+"""
+
+import numpy
+import ex45_grid
+
+
+# Number of doors for each 4-bit door mask.
+_DOOR_COUNTS = numpy.array([bin(mask).count('1') for mask in range(16)],
+                           numpy.uint8)
+
+
+def door_array(room_map):
+    """Returns the door array of a room_map."""
+
+    rooms = room_map.rooms
+    if isinstance(rooms, ex45_grid.CompactGrid):
+        cells = numpy.frombuffer(rooms.cells, numpy.uint8)
+        return (cells >> 4).reshape(room_map.size, room_map.size)
+
+    doors = numpy.zeros((room_map.size, room_map.size), numpy.uint8)
+    for (x, y), room in rooms.iteritems():
+        if room.real:
+            doors[y, x] = ex45_grid.door_mask(room)
+    return doors
+
+
+def _door(doors, direction):
+    return (doors >> direction & 1).astype(bool)
+
+
+def unmatched_doors(doors):
+    """Finds doors without a reciprocal door on the other side.
+
+    Returns a boolean array marking every room with a door that
+    leads off the map or into a room with no door back.
+    """
+
+    north = _door(doors, 0)
+    east = _door(doors, 1)
+    south = _door(doors, 2)
+    west = _door(doors, 3)
+
+    bad = numpy.zeros(doors.shape, bool)
+    bad[0, :] |= north[0, :]
+    bad[1:, :] |= north[1:, :] & ~south[:-1, :]
+    bad[-1, :] |= south[-1, :]
+    bad[:-1, :] |= south[:-1, :] & ~north[1:, :]
+    bad[:, -1] |= east[:, -1]
+    bad[:, :-1] |= east[:, :-1] & ~west[:, 1:]
+    bad[:, 0] |= west[:, 0]
+    bad[:, 1:] |= west[:, 1:] & ~east[:, :-1]
+    return bad
+
+
+def degrees(doors):
+    """Returns the number of doors of each room."""
+
+    return _DOOR_COUNTS[doors]
+
+
+def dead_ends(doors):
+    """Returns a boolean array marking rooms with a single door."""
+
+    return degrees(doors) == 1
+
+
+def label_components(doors, rooms=None):
+    """Labels the groups of rooms that are connected by doors.
+
+    rooms is a boolean array marking the cells holding a room, and
+    defaults to every cell with a door. Returns the labels, 1 up to
+    the number of components for rooms and 0 elsewhere, along with
+    the number of components. Doors are assumed to be reciprocal;
+    see unmatched_doors().
+    """
+
+    if rooms is None:
+        rooms = doors > 0
+    cells = numpy.arange(doors.size).reshape(doors.shape)
+
+    # Each door joins a pair of cells, given here by flat index.
+    north = _door(doors, 0)[1:, :]
+    west = _door(doors, 3)[:, 1:]
+    a = numpy.concatenate((cells[1:, :][north], cells[:, 1:][west]))
+    b = numpy.concatenate((cells[:-1, :][north], cells[:, :-1][west]))
+
+    # Every cell starts as its own component. Each pass hooks the
+    # larger of two joined labels onto the smaller, then flattens
+    # every label to its root, until all doors join equal labels.
+    labels = cells.ravel().copy()
+    while True:
+        (label_a, label_b) = (labels[a], labels[b])
+        joined = label_a != label_b
+        if not joined.any():
+            break
+        low = numpy.minimum(label_a[joined], label_b[joined])
+        high = numpy.maximum(label_a[joined], label_b[joined])
+        numpy.minimum.at(labels, high, low)
+        while True:
+            roots = labels[labels]
+            if numpy.array_equal(roots, labels):
+                break
+            labels = roots
+
+    # Number the components of rooms from 1, leaving other cells 0.
+    labels = labels.reshape(doors.shape)
+    (roots, numbers) = numpy.unique(labels[rooms], return_inverse=True)
+    numbered = numpy.zeros(doors.shape, numpy.int64)
+    numbered[rooms] = numbers + 1
+    return numbered, len(roots)
+
+
+def door_stats(room_map):
+    """Summarises the doors of a room_map in a dictionary."""
+
+    doors = door_array(room_map)
+    rooms = doors > 0
+    room_degrees = degrees(doors)
+    (labels, components) = label_components(doors, rooms)
+    return {'rooms': int(rooms.sum()),
+            'doors': int(room_degrees.sum()) // 2,
+            'mean_degree': float(room_degrees[rooms].mean()) if rooms.any()
+                           else 0.0,
+            'dead_ends': int(dead_ends(doors).sum()),
+            'unmatched': int(unmatched_doors(doors).sum()),
+            'components': components}
@@ -1,45 +1,37 @@
-"""This file contains the room, game and fight engines. The room
+"""This file contains the room and game engines. The room
 engine handles room creation and passing the user into rooms. The game
-engine then handles moving the user between rooms. The fight engine
-deals with user-enemy encounters.
+engine then handles moving the user between rooms. The fight engine,
+which deals with user-enemy encounters, is in ex45_fight.py.
 """
 
 
+import sys
 import random
 import bisect
-from ex45_text import clear
-from ex45_map import draw_map
-from ex45_chars import Hero
-
-
-class FightEngine(object):
-    """
-    """
-
-    @staticmethod
-    def attack(being_a, being_b):
-        attack = random.randint(*being_a.attack)
-        print "%s hits for %d!" % (being_a, attack)
-        being_b.hit_points -= attack
-        return being_b
-
-    @staticmethod
-    def battle(hero, monsters):
-        monster = monsters.pop(monsters.index(random.choice(monsters)))
-        monster = FightEngine.attack(hero, monster)
-        if monster.hit_points > 0:
-            monsters.append(monster)
-        if monsters:
-            for monster in monsters:
-                hero = FightEngine.attack(monster, hero)
-                if hero.hit_points <= 0:
-                    print "You died!"
-                    exit(0)
-            (hero, monsters) = FightEngine.battle(hero, monsters)
-        return hero, monsters
+import struct
+from collections import deque
+from ex45_text import interactive, screen
+from ex45_map import MapRenderer
+from ex45_chars import Hero, MonsterStore
+# The fight engine lives in ex45_fight; it is imported here for the
+# code that still expects it in this file.
+from ex45_fight import FightOutcome, FightEngine
+import ex45_rooms
+import ex45_grid
+import ex45_route
 
 
-import ex45_rooms
+def _seeded_random(seed):
+    # Returns a random.Random in the state numpy.random.RandomState(seed)
+    # starts in. Both are Mersenne Twisters making doubles the same way,
+    # so they go on to draw the same numbers.
+    state = [seed]
+    for i in xrange(1, 624):
+        state.append((1812433253 * (state[-1] ^ state[-1] >> 30) + i) &
+                     0xffffffff)
+    rng = random.Random()
+    rng.setstate((3, tuple(state) + (624,), None))
+    return rng
 
 
 class RoomEngine(object):
@@ -47,10 +39,18 @@ class RoomEngine(object):
 
     An instance of this object first creates a blank dict
     of rooms, which can later be populated through .add_room().
-    It also holds all necessary variables for random map generation.
+    It also holds all necessary variables for random map generation,
+    including its own random number generator: maps built from the
+    same size and seed are always the same.
 
     Later, the game engine calls the fetch_room() method to pass the
     hero into individual rooms.
+
+    The map is a plain dict by default. With backend='compact' it is
+    an ex45_grid.CompactGrid instead, which packs every cell into a
+    byte and only instantiates real rooms when they are looked up.
+    With backend='sparse' it is an ex45_grid.SparseGrid, which never
+    stores the cells that generation leaves untouched.
     """
 
     # These dummy room types are created at the next_coord location.
@@ -66,6 +66,23 @@ class RoomEngine(object):
                        ('HealingRoom', 0.5)
                        )
 
+    # Map generation knobs: at least min_rooms rooms follow the first
+    # room, and each open side of a room leads to a new room with
+    # probability room_chance. Set them on an engine to tune it.
+    min_rooms = 3
+    room_chance = 0.5
+
+    # With batch_room_types, generic rooms are given their types all at
+    # once when generation is done, through assign_room_types(). This
+    # draws from the random number generator in a different order, so
+    # a seed gives a different map than without it.
+    batch_room_types = False
+
+    # How deep in the dungeon the map is, and the size of the
+    # dungeon's first level when this is a deeper one; see ex45_levels.
+    level = 1
+    first_size = None
+
     # This direction dictionary helps the move-variable in the
     # fetch_room() method point to the next room.
     _direction = {0: (0, -1), # Shift up one row.
@@ -75,28 +92,93 @@ class RoomEngine(object):
                   4: (0, 0)   # Repeat this room.
                   }
 
-    def __init__(self, size):
-        self.rooms = {}
+    def __init__(self, size, backend='dict', seed=None):
+        if backend == 'compact':
+            self.rooms = ex45_grid.CompactGrid(size)
+        elif backend == 'sparse':
+            self.rooms = ex45_grid.SparseGrid(size)
+        elif backend == 'dict':
+            self.rooms = {}
+        else:
+            raise ValueError("Unknown map backend: %r" % backend)
         self.size = size
+        self.seed = seed
+        self.random = random.Random(seed)
         self.next_coord = None
         self.coord = None
         self.init_coord = None
         self.doors = []
 
+        # Coordinates of future rooms still waiting to be handled,
+        # in creation order. future_set mirrors the queue so that a
+        # room is never queued twice.
+        self.future_rooms = deque()
+        self.future_set = set()
+
+        # Built the first time routes are asked for; see routes.
+        self._routes = None
+
+        # Every monster on the map, filled by populate_map().
+        self.monster_store = MonsterStore()
+
+        # Compile the room type weights once, rather than on every
+        # pick.
+        self._room_values, weights = zip(*self._standard_rooms)
+        self._total_weight = 0
+        self._cum_weights = []
+        for weight in weights:
+            self._total_weight += weight
+            self._cum_weights.append(self._total_weight)
+
     def _pick_random_room(self):
         """This method picks a random room type based on weighted
         probability values of each room type.
         """
 
-        values, weights = zip(*self._standard_rooms)
-        total_weight = 0
-        cum_weights = []
-        for weight in weights:
-            total_weight += weight
-            cum_weights.append(total_weight)
-        random_point = random.random() * total_weight
-        j = bisect.bisect(cum_weights, random_point)
-        return values[j]
+        random_point = self.random.random() * self._total_weight
+        j = bisect.bisect(self._cum_weights, random_point)
+        return self._room_values[j]
+
+    def _pick_random_rooms(self, count):
+        """Picks count random room types at once.
+
+        The types are drawn from the same weights as
+        _pick_random_room(), by a generator seeded from this engine's
+        random number generator. If NumPy is installed, the picks are
+        vectorized. They are the same either way.
+        """
+
+        seed = self.random.getrandbits(32)
+        try:
+            import numpy
+        except ImportError:
+            rng = _seeded_random(seed)
+            return [self._room_values[bisect.bisect(self._cum_weights,
+                                                    rng.random() *
+                                                    self._total_weight)]
+                    for i in xrange(count)]
+
+        rng = numpy.random.RandomState(seed)
+        random_points = rng.random_sample(count) * self._total_weight
+        j = numpy.searchsorted(self._cum_weights, random_points, 'right')
+        return [self._room_values[i] for i in j]
+
+    def assign_room_types(self, coords):
+        """Gives the rooms at coords random standard types, all picked
+        at once by _pick_random_rooms(). Each room keeps its number
+        and doors.
+        """
+
+        room_types = self._pick_random_rooms(len(coords))
+        for coord, room_type in zip(coords, room_types):
+            old_room = self.rooms[coord]
+            room = ex45_rooms.ROOM_CLASSES[room_type](old_room.room_number)
+            for i in range(4):
+                if old_room.get_door(i):
+                    room.create_door(i)
+            self.rooms[coord] = room
+            if self._routes is not None:
+                self._routes.update_room(coord)
 
     def add_room(self, room_type, *args):
         """Adds a dummy or real room to the game map.
@@ -107,10 +189,17 @@ class RoomEngine(object):
         choice from a randomly generated weighted list.
         """
 
-        # If creating a dummy room, act on next_coord.
+        # If creating a dummy room, act on next_coord. Dummy rooms
+        # are flyweights: every cell of a type shares one instance.
         if room_type in self._dummy_rooms:
-            room_class = getattr(ex45_rooms, room_type)
+            room_class = ex45_rooms.ROOM_CLASSES[room_type]
             self.rooms[self.next_coord] = room_class()
+            if (room_type == 'FutureRoom' and
+                    self.next_coord not in self.future_set):
+                self.future_set.add(self.next_coord)
+                self.future_rooms.append(self.next_coord)
+            if self._routes is not None:
+                self._routes.update_room(self.next_coord)
             return
 
         # For other room types, the room_number variable is passed
@@ -121,49 +210,150 @@ class RoomEngine(object):
         if room_type == 'generic':
             room_type = self._pick_random_room()
 
-        room_class = getattr(ex45_rooms, room_type)
-        self.rooms[self.coord] = room_class(room_number)
+        room_class = ex45_rooms.ROOM_CLASSES[room_type]
+        room = room_class(room_number)
 
-        # Create appropriate doors.
+        # Create appropriate doors before the room is stored, as
+        # compact maps pack the doors away on assignment.
         for i in self.doors:
-            self.rooms[self.coord].create_door(i)
+            room.create_door(i)
+        self.rooms[self.coord] = room
+        if self._routes is not None:
+            self._routes.update_room(self.coord)
         return
 
-    def fetch_room(self, a_game, hero):
-        """Sends the user into a room and returns the next room.
+    @property
+    def routes(self):
+        """The ex45_route.RouteIndex of this map, built the first time
+        it is used, once the map has been generated.
+        """
+
+        if self._routes is None:
+            self._routes = ex45_route.RouteIndex(self)
+        return self._routes
 
-        The game engine points to this method, which enter()s
-        Rooms and returns movement choice from them. Movement
-        chocies are then interrogated against the map to
-        ensure that they are valid.
+    # Binary exports start with this header: a magic string, format
+    # version and map size. The size * size cell bytes follow, row by
+    # row, each as packed by ex45_grid.cell_byte().
+    _export_header = struct.Struct('<4sHI')
+
+    def export(self, path, fmt='text'):
+        """Writes the map to a file, one row at a time.
+
+        fmt is 'text' for rows of room symbols, 'ppm' for an image
+        with a pixel per room or 'binary' for the raw cell bytes.
+        Only one row of the map is held in memory at a time.
+        """
+
+        writers = {'text': self.export_text,
+                   'ppm': self.export_ppm,
+                   'binary': self.export_binary}
+        try:
+            writer = writers[fmt]
+        except KeyError:
+            raise ValueError("Unknown export format: %r" % fmt)
+        with open(path, 'wb') as out_file:
+            writer(out_file)
+
+    def export_text(self, out_file):
+        for row in ex45_grid.cell_rows(self):
+            out_file.write(ex45_grid.text_row(row))
+
+    def export_ppm(self, out_file):
+        out_file.write("P6\n%d %d\n255\n" % (self.size, self.size))
+        for row in ex45_grid.cell_rows(self):
+            out_file.write(ex45_grid.ppm_row(row))
+
+    def export_binary(self, out_file):
+        out_file.write(self._export_header.pack('EX45', 1, self.size))
+        for row in ex45_grid.cell_rows(self):
+            out_file.write(row)
+
+    def fetch_room(self, hero, source=interactive, out=screen):
+        """Sends the hero into the current room.
+
+        The game engine points to this method, which enter()s the
+        current Room and returns the movement choice made there.
+        Any input the room needs is read from source, and its text
+        is written to out.
         """
 
         # move receives relative position change from .enter().
-        (move, hero) = self.rooms[self.coord].enter(hero)
-        move = int(move)
-        clear()
-        next_coord = (self.coord[0] + self._direction[move][0],
-            self.coord[1] + self._direction[move][1])
+        (move, hero) = self.rooms[self.coord].enter(hero, source, out)
+        return move, hero
 
-        self.rooms[self.coord].current_room = False
+    def move_hero(self, move, hero):
+        """Moves the hero out of the current room.
+
+        Movement choices are interrogated against the map to ensure
+        that they are valid, and the hero only moves through a door
+        into a real room. Returns a description of what happened.
+        """
+
+        try:
+            move = int(move)
+            shift = self._direction[move]
+        except (ValueError, KeyError):
+            return "Not a valid move."
+        next_coord = (self.coord[0] + shift[0], self.coord[1] + shift[1])
 
         try:
-            if self.rooms[next_coord].real:
-                pass
-        except KeyError as e:
-            a_game.next_room(self, hero, "Out of bounds!")
-
-        if self.rooms[next_coord].real == True:
-            if self.rooms[self.coord].get_door(move):
-                # If there is a room and door in this direction, go.
-                self.coord = next_coord
-                if move < 4:
-                    hero.direction = move
-                a_game.next_room(self, hero, "Valid door.")
-            else:
-                a_game.next_room(self, hero, "Door does not exist.")
+            next_room = self.rooms[next_coord]
+        except KeyError:
+            return "Out of bounds!"
+
+        if not next_room.real:
+            return "Room does not exist."
+        if not self.rooms[self.coord].get_door(move):
+            return "Door does not exist."
+
+        # If there is a room and door in this direction, go.
+        self.rooms[self.coord].current_room = False
+        self.coord = next_coord
+        next_room.current_room = True
+        if move < 4:
+            hero.direction = move
+        return "Valid door."
+
+
+    def travel_hero(self, where, hero):
+        """Walks the hero along the shortest route to a room.
+
+        where is a room number, 'last' for the last room, or nothing
+        for the nearest room not yet visited. The hero walks through
+        rooms already visited, but stops on reaching a room with
+        monsters or one not visited before, as those rooms have to be
+        entered. Returns a description of what happened.
+        """
+
+        routes = self.routes
+        if where == '':
+            nearest = routes.nearest_unvisited(self.coord)
+            if nearest is None:
+                return "No unvisited rooms left."
+            target = nearest[2]
+        elif where == 'last':
+            target = routes.last_room()
         else:
-            a_game.next_room(self, hero, "Room does not exist.")
+            try:
+                target = routes.room_coord(int(where))
+            except ValueError:
+                return "Not a valid destination."
+        if target is None or routes.distance(self.coord, target) is None:
+            return "No route to that room."
+
+        hops = 0
+        while self.coord != target:
+            self.move_hero(routes.next_hop(self.coord, target), hero)
+            hops += 1
+            room = self.rooms[self.coord]
+            if room.monsters or room._first_visit:
+                break
+        travelled = "Travelled %d room%s" % (hops, 's' if hops != 1 else '')
+        if self.coord != target:
+            return "%s, stopping at room %d." % (travelled,
+                self.rooms[self.coord].room_number)
+        return travelled + "."
 
 
 class GameEngine(object):
@@ -171,29 +361,119 @@ class GameEngine(object):
 
     This engine starts the player in the first room and handles
     shifting the player between rooms with the RoomEngine.fetch_room()
-    method. A map is also printed to help the user navigate the dungeon.
+    and RoomEngine.move_hero() methods. A map of the rooms around the
+    hero is also printed to help the user navigate the dungeon.
+
+    The game runs as a loop of turns, so a game of any length uses the
+    same stack and memory. Each turn the hero enters the current room
+    and the move chosen there is passed to step(). Scripts and bots
+    can also drive the hero by calling step() directly.
+
+    Player input is read from source, an ex45_text.InputSource, and
+    everything the game shows is written to output, an
+    ex45_text.OutputSink. The game stops when the source runs out of
+    input.
+
+    Reaching the last room takes the hero down to the next level from
+    levels, an ex45_levels.LevelLoader. Without one, the hero leaves
+    the dungeon and the program ends.
     """
 
-    def start(self, room_map):
-        """Start the hero in the starting room"""
-        room_map.coord = room_map.init_coord
-        room_map.rooms[room_map.coord].current_room = True
-        hero = Hero()
-        print "Beginning quest!"
-        draw_map(room_map)
-        print "Currently facing", hero.direction
-        print "Monsters:", room_map.rooms[room_map.coord].monsters
-        room_map.fetch_room(self, hero)
-
-    def next_room(self, room_map, hero, text):
-        """Continue the adventure to the next room as returned by
-        room_map.fetch_room().
+    def __init__(self, source=interactive, output=screen, levels=None):
+        self.source = source
+        self.output = output
+        self.levels = levels
+
+    def start(self, room_map, hero=None, resume=False):
+        """Start the hero in the starting room and play the game."""
+        self.setup(room_map, hero, resume)
+        self.play()
+
+    def setup(self, room_map, hero=None, resume=False):
+        """Place the hero in the starting room, ready to play. If
+        resume is set, the hero carries on from room_map.coord
+        instead, as in a game loaded by ex45_save.load_game().
         """
+        self.hero = hero if hero is not None else Hero()
+        self.running = True
+        self.enter_level(room_map, resume)
+        if resume:
+            self.output.say("Resuming quest!")
+        else:
+            self.output.say("Beginning quest!")
+        self.show()
 
-        print text
+    def enter_level(self, room_map, resume=False):
+        """Make room_map the level being played, with the hero in its
+        starting room, or at room_map.coord if resume is set. The
+        level below starts building in the background.
+        """
+        if not resume:
+            room_map.coord = room_map.init_coord
         room_map.rooms[room_map.coord].current_room = True
-        draw_map(room_map)
-        print "Currently facing", hero.direction
-        print "Monsters:", room_map.rooms[room_map.coord].monsters
-        room_map.fetch_room(self, hero)
+        self.room_map = room_map
+        self.renderer = MapRenderer(room_map)
+        self.last_coord = room_map.coord
+        if self.levels is not None:
+            self.levels.prefetch()
+
+    def play(self):
+        """Play turns until the game stops running."""
+        try:
+            while self.running:
+                try:
+                    self.turn()
+                except EOFError:
+                    self.running = False
+        finally:
+            self.output.flush()
+
+    def turn(self):
+        """Enter the current room and make the move chosen there."""
+        (move, self.hero) = self.room_map.fetch_room(self.hero,
+            self.source, self.output)
+        return self.step(move)
+
+    def step(self, move):
+        """Make a single move, 0-3 for a door or 4 to stay put, and
+        show where the hero ended up. A move of 'travel', followed by
+        a room number, 'last' or nothing, walks the hero there through
+        RoomEngine.travel_hero(), and ex45_rooms.DESCEND takes the hero
+        down to the next level. Returns what happened.
+        """
 
+        self.output.clear()
+        if move is ex45_rooms.DESCEND:
+            text = self.descend()
+        elif isinstance(move, basestring) and move.startswith('travel'):
+            text = self.room_map.travel_hero(move[len('travel'):].strip(),
+                                             self.hero)
+        else:
+            text = self.room_map.move_hero(move, self.hero)
+        self.output.say(text)
+        self.show()
+        return text
+
+    def descend(self):
+        """Swap the level being played for the one below it, or end
+        the game if there are no more levels.
+        """
+        if self.levels is None:
+            self.output.say("Last room! You escaped the dungeon!")
+            self.output.flush()
+            sys.exit(0)
+        self.enter_level(self.levels.descend())
+        return ("Last room! A stairway leads further down.\n"
+                "You descend to level %d." % self.room_map.level)
+
+    def show(self):
+        """Print the map around the hero and the current room."""
+
+        # Only the room left behind and the room entered look
+        # different on the map.
+        room_map = self.room_map
+        self.renderer.mark(self.last_coord, room_map.coord)
+        self.last_coord = room_map.coord
+        self.renderer.draw(self.output)
+        self.output.say("Currently facing", self.hero.direction)
+        self.output.say("Monsters:", room_map.rooms[room_map.coord].monsters)
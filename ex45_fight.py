@@ -0,0 +1,74 @@
+"""This file contains the fight engine, which deals with user-enemy
+encounters, and the outcome of a fight. The rooms start fights, and
+ex45_odds works out their odds, so this file stands on its own.
+"""
+
+import random
+from ex45_text import screen
+
+
+class FightOutcome(object):
+    """The result of a battle.
+
+    Holds the hero and the monsters left standing, the number of
+    rounds fought, a log of every hit as (attacker, defender, damage)
+    and the survivor: 'hero' if the hero won, otherwise 'monsters'.
+    """
+
+    def __init__(self, hero, monsters):
+        self.hero = hero
+        self.monsters = monsters
+        self.rounds = 0
+        self.log = []
+        self.survivor = None
+
+    def __repr__(self):
+        return "<%s won after %d rounds>" % (self.survivor, self.rounds)
+
+
+class FightEngine(object):
+    """Resolves battles between the hero and a mob of monsters.
+
+    Each round the hero hits a random monster, then every monster
+    still standing hits the hero, until one side is dead.
+    """
+
+    @staticmethod
+    def attack(being_a, being_b, quiet=False, out=screen):
+        """being_a hits being_b and the damage done is returned."""
+        attack = random.randint(*being_a.attack)
+        if not quiet:
+            out.say("%s hits for %d!" % (being_a, attack))
+        being_b.hit_points -= attack
+        return attack
+
+    @staticmethod
+    def battle(hero, monsters, quiet=False, out=screen):
+        """Fights until the hero or all the monsters are dead.
+
+        Dead monsters are removed from the monsters list. Hits are
+        written to out, except in quiet mode, so that fights can be
+        auto-resolved in bulk. Returns a FightOutcome.
+        """
+
+        outcome = FightOutcome(hero, monsters)
+        while monsters and hero.hit_points > 0:
+            outcome.rounds += 1
+
+            i = random.randrange(len(monsters))
+            monster = monsters[i]
+            damage = FightEngine.attack(hero, monster, quiet, out)
+            outcome.log.append((hero, monster, damage))
+            if monster.hit_points <= 0:
+                # Swap the dead monster to the end to drop it.
+                monsters[i] = monsters[-1]
+                monsters.pop()
+
+            for monster in monsters:
+                damage = FightEngine.attack(monster, hero, quiet, out)
+                outcome.log.append((monster, hero, damage))
+                if hero.hit_points <= 0:
+                    break
+
+        outcome.survivor = 'hero' if hero.hit_points > 0 else 'monsters'
+        return outcome
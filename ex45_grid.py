@@ -0,0 +1,336 @@
+"""
+This file contains the compact and sparse storage backends for the
+RoomEngine map. The compact grid holds the map in flat buffers
+indexed by y * size + x and only instantiates real rooms when
+something looks at them. The sparse grid only stores the cells that
+map generation actually touches.
+"""
+
+
+from array import array
+
+
+# The index of a room type in this tuple is its type code. Codes
+# below REAL_CODE are dummy rooms, the rest are real rooms.
+ROOM_TYPES = ('EmptyRoom', 'NonRoom', 'FutureRoom', 'CurrentRoom',
+              'FirstRoom', 'LastRoom', 'TombRoom', 'PlainRoom',
+              'TortureRoom', 'PrisonRoom', 'HealingRoom')
+TYPE_CODES = dict((room_type, code)
+                  for code, room_type in enumerate(ROOM_TYPES))
+REAL_CODE = TYPE_CODES['FirstRoom']
+
+# How each room type is written in maps, as in its room's __repr__(),
+# and its colour in map images.
+TYPE_SYMBOLS = ('_e', '__', '_u', '_c', 'Fi', 'La', 'Tb', 'Pl', 'Tr', 'Pr',
+                'He')
+TYPE_COLOURS = ((0, 0, 0), (0, 0, 0), (80, 80, 80), (255, 255, 255),
+                (0, 200, 0), (220, 0, 0), (150, 100, 200), (200, 200, 200),
+                (200, 120, 60), (90, 120, 200), (80, 200, 200))
+
+
+def _cell_table(value):
+    # Builds a 256 character translation table giving value(code,
+    # doors) for every cell byte.
+    return str(bytearray([value(cell & 0x0f, cell >> 4)
+                          for cell in range(256)]))
+
+
+def _brightness(colour, doors):
+    # Rooms with more doors are drawn brighter.
+    return colour * (4 + bin(doors).count('1')) // 8
+
+
+# Translates cell bytes to 1 for real rooms and 0 for the rest.
+_REAL_TABLE = _cell_table(lambda code, doors: code >= REAL_CODE)
+
+_TEXT_TABLES = [_cell_table(lambda code, doors, i=i:
+                            ord(TYPE_SYMBOLS[code % len(ROOM_TYPES)][i]))
+                for i in range(2)]
+_PPM_TABLES = [_cell_table(lambda code, doors, i=i:
+                           _brightness(TYPE_COLOURS[code % len(ROOM_TYPES)][i],
+                                       doors))
+               for i in range(3)]
+
+
+def text_row(row):
+    """Turns a row of cell bytes into a line of room symbols."""
+
+    line = bytearray(' ') * (3 * len(row))
+    line[0::3] = row.translate(_TEXT_TABLES[0])
+    line[1::3] = row.translate(_TEXT_TABLES[1])
+    line[-1] = '\n'
+    return line
+
+
+def ppm_row(row):
+    """Turns a row of cell bytes into a row of RGB pixels."""
+
+    pixels = bytearray(3 * len(row))
+    for i in range(3):
+        pixels[i::3] = row.translate(_PPM_TABLES[i])
+    return pixels
+
+
+def door_mask(room):
+    """Packs a room's four real doors into a 4-bit mask.
+
+    Bit i is set when the room has a door in direction i. Dummy
+    rooms have no doors and always give 0.
+    """
+
+    if not room.real:
+        return 0
+    mask = 0
+    for i in range(4):
+        if room.doors[i]:
+            mask |= 1 << i
+    return mask
+
+
+def cell_byte(room):
+    """Packs a room into a single byte: the type code in the low
+    nibble and the door mask in the high nibble.
+    """
+
+    return TYPE_CODES[room.room_type] | door_mask(room) << 4
+
+
+# Filled from ex45_rooms.ROOM_CLASSES on first use. ex45_rooms needs
+# ex45_chars, which needs this module, so it is not imported here.
+_ROOM_CLASSES = {}
+
+
+def _room_class(room_type):
+    if not _ROOM_CLASSES:
+        import ex45_rooms
+        _ROOM_CLASSES.update(ex45_rooms.ROOM_CLASSES)
+    return _ROOM_CLASSES[room_type]
+
+
+class CompactGrid(object):
+    """A dict-like map of (x, y) coordinates to rooms.
+
+    Each cell is one byte in the cells buffer, holding the room's
+    type code and door mask (see cell_byte()), and real rooms keep
+    their room number in the numbers array. Dummy rooms handed out
+    by this grid are shared, since they carry no state. Real rooms
+    are instantiated from the buffers the first time they are
+    looked up and kept from then on, so that the hero and monsters
+    can change them.
+    """
+
+    prefilled = True
+
+    def __init__(self, size):
+        self.size = size
+        self.cells = bytearray(size * size)     # All 'EmptyRoom'.
+        self.numbers = array('I', [0]) * (size * size)
+        self._rooms = {}
+
+    def _index(self, coord):
+        (x, y) = coord
+        if not (0 <= x < self.size and 0 <= y < self.size):
+            raise KeyError(coord)
+        return y * self.size + x
+
+    def __getitem__(self, coord):
+        index = self._index(coord)
+        try:
+            return self._rooms[index]
+        except KeyError:
+            pass
+
+        code = self.cells[index] & 0x0f
+        if code < REAL_CODE:
+            # Dummy rooms are shared, so this is always the same one.
+            return _room_class(ROOM_TYPES[code])()
+
+        # Instantiate the real room from its packed form.
+        room_class = _room_class(ROOM_TYPES[code])
+        room = room_class(self.numbers[index])
+        mask = self.cells[index] >> 4
+        for i in range(4):
+            if mask & 1 << i:
+                room.create_door(i)
+        self._rooms[index] = room
+        return room
+
+    def __setitem__(self, coord, room):
+        index = self._index(coord)
+        self._rooms.pop(index, None)
+        self.cells[index] = cell_byte(room)
+        if room.real:
+            self.numbers[index] = room.room_number
+
+    def __contains__(self, coord):
+        try:
+            self._index(coord)
+        except (KeyError, TypeError, ValueError):
+            return False
+        return True
+
+    def __len__(self):
+        return self.size * self.size
+
+    def __iter__(self):
+        for y in range(self.size):
+            for x in range(self.size):
+                yield (x, y)
+
+    def keys(self):
+        return list(self)
+
+    def iteritems(self):
+        for coord in self:
+            yield coord, self[coord]
+
+    def items(self):
+        return list(self.iteritems())
+
+    def values(self):
+        return [room for coord, room in self.iteritems()]
+
+    def get(self, coord, default=None):
+        try:
+            return self[coord]
+        except KeyError:
+            return default
+
+    def replace_dummy(self, old_type, new_type):
+        """Turns every old_type dummy room into a new_type one."""
+
+        table = bytearray(range(256))
+        table[TYPE_CODES[old_type]] = TYPE_CODES[new_type]
+        self.cells = self.cells.translate(str(table))
+
+    def rows(self):
+        """Yields each row of the map as a bytearray of cell bytes."""
+
+        for y in range(self.size):
+            yield self.cells[y * self.size:(y + 1) * self.size]
+
+    def real_cells(self):
+        """Yields ((x, y), cell byte) for every real room, found
+        without looking at every cell of the map.
+        """
+
+        real = self.cells.translate(_REAL_TABLE)
+        index = real.find('\x01')
+        while index != -1:
+            room = self._rooms.get(index)
+            cell = self.cells[index] if room is None else cell_byte(room)
+            yield (index % self.size, index // self.size), cell
+            index = real.find('\x01', index + 1)
+
+
+class SparseGrid(dict):
+    """A dict of only the map cells that have been touched.
+
+    Cells that were never assigned are not stored at all: looking one
+    up gives the shared dummy room named by default, 'EmptyRoom' while
+    the map is being generated and 'NonRoom' once it is filled. Work
+    and memory are therefore proportional to the number of generated
+    rooms rather than to the area of the map. Coordinates outside the
+    map still raise KeyError.
+    """
+
+    prefilled = True
+
+    def __init__(self, size):
+        super(SparseGrid, self).__init__()
+        self.size = size
+        self.default = 'EmptyRoom'
+        self.bounds = None
+
+    def __missing__(self, coord):
+        (x, y) = coord
+        if not (0 <= x < self.size and 0 <= y < self.size):
+            raise KeyError(coord)
+        return _room_class(self.default)()
+
+    def __setitem__(self, coord, room):
+        super(SparseGrid, self).__setitem__(coord, room)
+
+        # Track the smallest (x0, y0, x1, y1) box holding every
+        # touched cell, so the map can be drawn without the blank
+        # space around it.
+        (x, y) = coord
+        if self.bounds is None:
+            self.bounds = (x, y, x, y)
+        else:
+            (x0, y0, x1, y1) = self.bounds
+            self.bounds = (min(x0, x), min(y0, y), max(x1, x), max(y1, y))
+
+    def get(self, coord, default=None):
+        try:
+            return self[coord]
+        except KeyError:
+            return default
+
+    def replace_dummy(self, old_type, new_type):
+        """Turns every old_type dummy room into a new_type one."""
+
+        if self.default == old_type:
+            self.default = new_type
+        for coord, room in self.items():
+            if room.room_type == old_type:
+                self[coord] = _room_class(new_type)()
+
+    def rows(self):
+        """Yields each row of the map as a bytearray of cell bytes.
+
+        Only the touched cells are looked at: they are sorted into
+        rows once, and every other cell is the default dummy room.
+        """
+
+        touched = {}
+        for (x, y), room in self.iteritems():
+            touched.setdefault(y, []).append((x, cell_byte(room)))
+
+        blank = bytearray([TYPE_CODES[self.default]]) * self.size
+        for y in range(self.size):
+            row = blank[:]
+            for x, cell in touched.get(y, ()):
+                row[x] = cell
+            yield row
+
+    def real_cells(self):
+        """Yields ((x, y), cell byte) for every real room."""
+
+        for coord, room in self.iteritems():
+            if room.real:
+                yield coord, cell_byte(room)
+
+
+def real_cells(room_map):
+    """Yields ((x, y), cell byte) for every real room of a room_map.
+
+    Maps that can find their real rooms quickly do so; a plain dict
+    map is searched one cell at a time.
+    """
+
+    if hasattr(room_map.rooms, 'real_cells'):
+        for item in room_map.rooms.real_cells():
+            yield item
+        return
+
+    for coord, room in room_map.rooms.iteritems():
+        if room.real:
+            yield coord, cell_byte(room)
+
+
+def cell_rows(room_map):
+    """Yields each row of a room_map as a bytearray of cell bytes.
+
+    Compact and sparse maps produce their rows directly. A plain dict
+    map is packed one cell at a time.
+    """
+
+    if hasattr(room_map.rooms, 'rows'):
+        for row in room_map.rooms.rows():
+            yield row
+        return
+
+    for y in range(room_map.size):
+        yield bytearray([cell_byte(room_map.rooms[(x, y)])
+                         for x in range(room_map.size)])
@@ -0,0 +1,102 @@
+"""This file builds the deeper levels of the dungeon. Each level is
+larger than the one above it, needs more rooms and has tougher
+monsters. The next level is generated on a worker thread while the
+hero explores the current one, so stepping into the last room swaps
+levels at once.
+
+At most one level is held here, the next, so with the level being
+played only two levels are ever in memory.
+"""
+
+from ex45_engines import RoomEngine
+from ex45_map import build_map
+from ex45_chars import populate_map
+
+
+class LevelLoader(object):
+    """Builds level after level of a dungeon that starts at size.
+
+    Level n is growth ** (n - 1) times as wide as the first, has
+    rooms_step more rooms forced per level than RoomEngine.min_rooms,
+    and its monsters' hit points and attack are multiplied by
+    difficulty ** (n - 1). With a seed, level n is generated from
+    seed + n - 1, so the whole dungeon can be played again.
+
+    With background set, the level below is built on a daemon thread
+    as soon as the hero reaches a level. Without it, each level is
+    built when it is descended to, which suits servers running many
+    games at once. level is the level being played, for games resumed
+    part way down.
+    """
+
+    growth = 1.25
+    rooms_step = 2
+    difficulty = 1.2
+
+    def __init__(self, size, backend='sparse', seed=None, cache=None,
+                 background=True, level=1):
+        self.size = size
+        self.backend = backend
+        self.seed = seed
+        self.cache = cache
+        self.background = background
+        self.level = level
+        self._next = None
+        self._error = None
+        self._thread = None
+
+    def build(self, level):
+        """Generates and populates level, and returns its room_map."""
+
+        scale = self.growth ** (level - 1)
+        seed = self.seed + level - 1 if self.seed is not None else None
+        room_map = RoomEngine(int(round(self.size * scale)), self.backend,
+                              seed)
+        room_map.level = level
+        room_map.first_size = self.size
+        room_map.min_rooms = RoomEngine.min_rooms + self.rooms_step * (
+            level - 1)
+        room_map = populate_map(build_map(room_map, self.cache))
+        room_map.monster_store.scale(self.difficulty ** (level - 1))
+        return room_map
+
+    def _build_next(self, level):
+        try:
+            self._next = self.build(level)
+        except Exception as error:
+            # Raised again by descend(), on the game's thread.
+            self._error = error
+
+    def prefetch(self):
+        """Starts building the level below the current one, unless it
+        is built or being built already. Does nothing without
+        background.
+        """
+
+        if not self.background or self._next is not None or self._thread:
+            return
+        # Only games building levels in the background need threads.
+        import threading
+        self._thread = threading.Thread(target=self._build_next,
+                                        args=(self.level + 1,))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def descend(self):
+        """Returns the room_map of the level below, waiting for it if
+        it is still being built, and starts on the one after.
+        """
+
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._error is not None:
+            (error, self._error) = (self._error, None)
+            raise error
+
+        (room_map, self._next) = (self._next, None)
+        if room_map is None:
+            room_map = self.build(self.level + 1)
+        self.level = room_map.level
+        self.prefetch()
+        return room_map
@@ -1,45 +1,168 @@
 """This is the main game file for example 45. From here methods
 and functions from supporting files are called to initialize
-and play the game.
+and play the game. Modules only some options need are imported when
+those options are given, to keep the game quick to start.
 """
 
-from sys import argv
-from ex45_text import clear
+import os
+import argparse
+from ex45_text import clear, interactive, screen, ScriptedInput
 from ex45_engines import GameEngine, RoomEngine
-from ex45_map import create_map, seed_map, generate_map
+from ex45_map import build_map
 from ex45_chars import populate_map
+from ex45_levels import LevelLoader
+from ex45_profile import Profiler, no_phase, install_game_hooks
 #~ from ex45_chars import Populate_Map
-import readline
 
 
-def main():
-    """When called, main() will run a text adventure game written to
-    fulfill the requirements of Learn Python the Hard Way's exercise 45.
+def play(args, source, phase):
+    """Sets up a new or saved game as args ask, then plays it.
+    Returns the GameEngine.
     """
 
-    size = int(argv[1])
     clear()
-    room_map = RoomEngine(size)
+    cache = None
+    if args.cache:
+        from ex45_cache import MapCache
+        cache = MapCache(args.cache)
+    # Levels are built in the background unless asked not to, or when
+    # profiling, as the profile would mix their phases with the first
+    # level's.
+    background = not (args.no_prefetch or args.profile)
+    if args.load:
+        # Carry on from a saved game, rather than a new dungeon.
+        from ex45_save import load_game
+        with phase('load_game'):
+            (room_map, hero) = load_game(args.load)
+        # Carry on down the same dungeon from the level saved.
+        first_seed = None
+        if room_map.seed is not None:
+            first_seed = room_map.seed - room_map.level + 1
+        levels = LevelLoader(room_map.first_size or room_map.size,
+                             args.backend, first_seed, cache, background,
+                             room_map.level)
+        a_game = GameEngine(source, levels=levels)
+        a_game.start(room_map, hero, resume=True)
+        return a_game
 
-    # Create a blank, square map of zeros.
-    room_map = create_map(room_map)
+    # Levels below the first are built by the LevelLoader.
+    levels = LevelLoader(args.size, args.backend, args.seed, cache,
+                         background)
+    a_game = GameEngine(source, levels=levels)
+    room_map = RoomEngine(args.size, args.backend, args.seed)
 
-    # Update map with a single, non-edge starting room.
-    (room_map) = seed_map(room_map)
-
-    # Randomly generate the rest of the map from the starting room.
-    (room_map) = generate_map(room_map)
+    # Create a blank map, place a non-edge starting room and randomly
+    # generate the rest of the map from it, unless it was cached.
+    with phase('build_map'):
+        room_map = build_map(room_map, cache)
 
     # Randomly populate with monsters, based on room type.
-    room_map = populate_map(room_map)
-
-    a_game = GameEngine()
+    with phase('populate_map'):
+        room_map = populate_map(room_map)
 
     # Start the game from the starting room
     a_game.start(room_map)
+    return a_game
+
+
+def main():
+    """When called, main() will run a text adventure game written to
+    fulfill the requirements of Learn Python the Hard Way's exercise 45.
+    """
+
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument('size', type=int, nargs='?',
+                        help="width of the square map")
+    parser.add_argument('--backend', default='sparse',
+                        choices=('dict', 'compact', 'sparse'),
+                        help="how the map is stored (default: sparse)")
+    parser.add_argument('--seed', type=int, default=None,
+                        help="generate the same dungeon every time")
+    parser.add_argument('--cache', metavar='DIR', default=None,
+                        help="reuse seeded dungeons cached in DIR")
+    parser.add_argument('--odds', metavar='FILE', default=None,
+                        help="keep the fight odds worked out so far in "
+                             "FILE (default: odds.pickle in the --cache "
+                             "directory, if one is given)")
+    parser.add_argument('--script', metavar='FILE', default=None,
+                        help="play the moves in FILE instead of asking")
+    parser.add_argument('--load', metavar='FILE', default=None,
+                        help="resume the game saved in FILE")
+    parser.add_argument('--save', metavar='FILE', default=None,
+                        help="save the game to FILE when play stops")
+    parser.add_argument('--no-prefetch', action='store_true',
+                        help="build each level when the hero reaches it, "
+                             "rather than in the background, as is always "
+                             "done with --profile")
+    parser.add_argument('--profile', metavar='FILE', default=None,
+                        help="write phase timings and call counts to FILE "
+                             "as JSON")
+    parser.add_argument('--trace-memory', action='store_true',
+                        help="add the largest allocation sites to the "
+                             "profile, where tracemalloc is available")
+    parser.add_argument('--cprofile', metavar='FILE', default=None,
+                        help="write cProfile stats for the whole game to FILE")
+    args = parser.parse_args()
+    if args.size is None and not args.load:
+        parser.error("a map size is needed to start a new game")
+
+    if args.script:
+        source = ScriptedInput(open(args.script), screen)
+    else:
+        # readline gives typed moves line editing and history, which
+        # only a player at the keyboard needs.
+        import readline
+        source = interactive
+
+    profiler = None
+    phase = no_phase
+    if args.profile:
+        profiler = Profiler(args.trace_memory)
+        install_game_hooks(profiler)
+        phase = profiler.phase
+    call_profile = None
+    if args.cprofile:
+        import cProfile
+        call_profile = cProfile.Profile()
+        call_profile.enable()
+
+    # Odds worked out in earlier games are reused, and new ones kept,
+    # only when asked for.
+    odds_path = args.odds
+    if odds_path is None and args.cache:
+        odds_path = os.path.join(args.cache, 'odds.pickle')
+    if odds_path is not None:
+        import ex45_odds
+        ex45_odds.keep_table(odds_path)
+
+    try:
+        a_game = play(args, source, phase)
+    finally:
+        # Also reached when the hero dies.
+        if odds_path is not None:
+            ex45_odds.save_table()
+        if call_profile is not None:
+            call_profile.disable()
+            call_profile.dump_stats(args.cprofile)
+        if profiler is not None:
+            profiler.remove()
+            profiler.write(args.profile)
+
+    # Play stops when input runs out; the hero dying ends
+    # the program before this point.
+    if args.save:
+        from ex45_save import save_game
+        save_game(args.save, a_game.room_map, a_game.hero)
+        screen.say("Game saved to %s" % args.save)
+        screen.flush()
 
     # Give myself a somewhat robust method to debug.
-    debug = raw_input("Debug (Y/N)?: ").lower()
+    if args.script:
+        return
+    try:
+        debug = source.get_line("Debug (Y/N)?: ").lower()
+    except EOFError:
+        return
     while debug == 'y':
         try:
             print input()
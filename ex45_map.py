@@ -4,17 +4,34 @@ generate a random, playable map for ex45_main.py
 """
 
 
-from random import randint
-from pprint import pprint
+import struct
+from ex45_text import screen
+import ex45_grid
+
+
+# Bump this whenever a change to map generation means the same seed
+# no longer gives the same map, so that cached maps are not reused.
+GENERATOR_VERSION = 2
+
+
+# An encoded map is a MAP_HEADER (size, starting x and y, number of
+# rooms) followed by one ROOM_RECORD (x, y, room number, cell byte)
+# per real room. See ex45_grid.cell_byte() for the cell byte.
+MAP_HEADER = struct.Struct('<IIII')
+ROOM_RECORD = struct.Struct('<IIIB')
 
 
 def create_map(room_map):
     """Creates a blank map.
 
     This function creates a dictionary with keys corresponding
-    to map x- and y-coordinates and zeros as values.
+    to map x- and y-coordinates and zeros as values. Compact and
+    sparse maps already start out blank, so they are left alone.
     """
 
+    if getattr(room_map.rooms, 'prefilled', False):
+        return room_map
+
     for i in range(room_map.size):
         for j in range(room_map.size):
             room_map.next_coord = (i, j)
@@ -29,8 +46,8 @@ def seed_map(room_map):
     is not allowed to occur at the edges of the map.
     """
 
-    room_map.init_coord = (randint(1, room_map.size - 2),
-        randint(1, room_map.size - 2))
+    room_map.init_coord = (room_map.random.randint(1, room_map.size - 2),
+        room_map.random.randint(1, room_map.size - 2))
 
     # 'CurrentRoom' room type uses next_coord to instantiate.
     room_map.next_coord = room_map.init_coord
@@ -60,8 +77,8 @@ def get_next(room_map):
         room_map.coord[1] + shift[room_map.i][1])
 
     # If the next room is in bounds, return the coordinate
-    if (next_coord[0] in range(0, room_map.size) and
-            next_coord[1] in range(0, room_map.size)):
+    if (0 <= next_coord[0] < room_map.size and
+            0 <= next_coord[1] < room_map.size):
         room_map.next_coord = next_coord
         return
     else:
@@ -99,9 +116,14 @@ def complete_room(room_map):
     if room_map.rooms[room_map.next_coord].room_type == 'NonRoom':
         return room_map
 
-    # Coin flip to decide if there is to be a room.
-    # mandatory_rooms overrides coin_flip while > 0.
-    coin_flip = randint(0, 1)
+    # Coin flip to decide if there is to be a room, weighted by
+    # room_map.room_chance. A fair coin still uses randint(), so that
+    # seeds give the same maps as ever. mandatory_rooms overrides
+    # coin_flip while > 0.
+    if room_map.room_chance == 0.5:
+        coin_flip = room_map.random.randint(0, 1)
+    else:
+        coin_flip = room_map.random.random() < room_map.room_chance
     if not coin_flip and room_map.mandatory_rooms <= 0:
         # If the room is not to exist, disallow future creation.
         if room_map.rooms[room_map.next_coord].room_type == 'EmptyRoom':
@@ -131,6 +153,24 @@ def check_map(room_map):
     return None      # Otherwise return None.
 
 
+def next_future_room(room_map):
+    """Pop the next room that needs to be handled.
+
+    Future rooms are queued on room_map.future_rooms as add_room()
+    creates them, so, unlike check_map(), this never has to scan the
+    whole map. Return the next room's (x,y) or None if the queue is
+    empty.
+    """
+
+    while room_map.future_rooms:
+        coord = room_map.future_rooms.popleft()
+        room_map.future_set.discard(coord)
+        if room_map.rooms[coord].room_type == 'FutureRoom':
+            return coord
+
+    return None
+
+
 def fill_empty_rooms(room_map):
     """Change empty rooms to non-rooms.
 
@@ -139,7 +179,12 @@ def fill_empty_rooms(room_map):
     those places.
     """
 
-    for coord, room in room_map.rooms.items():
+    # Compact and sparse maps can swap dummy rooms wholesale.
+    if hasattr(room_map.rooms, 'replace_dummy'):
+        room_map.rooms.replace_dummy('EmptyRoom', 'NonRoom')
+        return room_map
+
+    for coord, room in room_map.rooms.iteritems():
         if room.room_type == 'EmptyRoom':
             room_map.next_coord = coord
             room_map.add_room('NonRoom')
@@ -162,7 +207,10 @@ def generate_map(room_map):
     # This variable will force at least this many rooms to be
     # created, including generic and last rooms, but excluding
     # first room.
-    room_map.mandatory_rooms = 3
+    room_map.mandatory_rooms = room_map.min_rooms
+
+    # Rooms waiting for a type, with batch_room_types.
+    generic_rooms = []
 
     # Setting initial conditions to create the first room correctly.
     room_type = 'FirstRoom'
@@ -179,17 +227,25 @@ def generate_map(room_map):
         for room_map.i in range(0, 4):
             room_map = complete_room(room_map)
 
-        # If check_map returns none, there are no rooms after
-        # this room.
-        check = check_map(room_map)
+        # If next_future_room returns none, there are no rooms
+        # after this room.
+        check = next_future_room(room_map)
         if check == None:
             room_type = 'LastRoom'
 
-        # Create and add a room and its doors to room_engine.
-        room_map.add_room(room_type, room_number)
+        # Create and add a room and its doors to room_engine. With
+        # batch_room_types, generic rooms stand as plain rooms until
+        # the map is done.
+        if room_type == 'generic' and room_map.batch_room_types:
+            generic_rooms.append(room_map.coord)
+            room_map.add_room('PlainRoom', room_number)
+        else:
+            room_map.add_room(room_type, room_number)
 
         # Exit map generation if the last room has been handled
         if room_type == 'LastRoom':
+            if generic_rooms:
+                room_map.assign_room_types(generic_rooms)
             room_map = fill_empty_rooms(room_map)
             return room_map
 
@@ -204,20 +260,170 @@ def generate_map(room_map):
         room_number += 1
 
 
-def draw_map(room_map):
-    """Uses pprint to print a navigable map.
+def build_map(room_map, cache=None):
+    """Creates, seeds and generates a map in one go.
+
+    If an ex45_cache.MapCache is given, a map previously generated
+    with the same size, seed and knobs is loaded from it instead, and newly
+    generated maps are added to it.
+    """
+
+    if cache is not None and cache.load(room_map):
+        return room_map
+
+    room_map = create_map(room_map)
+    room_map = seed_map(room_map)
+    room_map = generate_map(room_map)
+
+    if cache is not None:
+        cache.save(room_map)
+    return room_map
+
+
+def encode_map(room_map):
+    """Packs a generated map into a compact string.
+
+    Only real rooms are written, so the result is proportional to
+    the number of rooms rather than to the area of the map. Any
+    cell not listed is a non-room.
+    """
+
+    records = []
+    for (x, y), room in room_map.rooms.iteritems():
+        if room.real:
+            records.append(ROOM_RECORD.pack(x, y, room.room_number,
+                ex45_grid.cell_byte(room)))
+
+    header = MAP_HEADER.pack(room_map.size, room_map.init_coord[0],
+        room_map.init_coord[1], len(records))
+    return header + ''.join(records)
+
+
+def load_map(room_map, data):
+    """Rebuilds a map from the output of encode_map().
+
+    The room_map should be freshly created with the same size as the
+    encoded map. Cells without a room are filled with non-rooms.
+    """
+
+    (size, init_x, init_y, count) = MAP_HEADER.unpack_from(data)
+    if size != room_map.size:
+        raise ValueError("Encoded map is %d wide, not %d" %
+            (size, room_map.size))
+
+    room_map = create_map(room_map)
+    room_map.init_coord = (init_x, init_y)
+
+    for offset in xrange(MAP_HEADER.size, len(data), ROOM_RECORD.size):
+        (x, y, room_number, cell) = ROOM_RECORD.unpack_from(data, offset)
+        room_map.coord = (x, y)
+        room_map.doors = [i for i in range(4) if cell >> 4 & 1 << i]
+        room_map.add_room(ex45_grid.ROOM_TYPES[cell & 0x0f], room_number)
+
+    room_map = fill_empty_rooms(room_map)
+    return room_map
+
+
+def draw_map(room_map, out=screen):
+    """Uses pprint to write out a navigable map.
 
     This function, given an object containing a dictionary of room
     objects, will generate a uniformly sized list-of-lists to be
-    printed with pprint.
+    formatted with pprint and written to out. Sparse maps are cropped
+    to the box holding their rooms.
     """
 
+    # pprint is only needed here, so it is not loaded by games that
+    # never draw the whole map.
+    from pprint import pformat
+
+    bounds = getattr(room_map.rooms, 'bounds', None)
+    if bounds is None:
+        bounds = (0, 0, room_map.size - 1, room_map.size - 1)
+    (x0, y0, x1, y1) = bounds
+
     # Create blank map array.
-    map_array = [[0 for y in range(room_map.size)]
-                  for x in range(room_map.size)]
+    map_array = [[0 for x in range(x0, x1 + 1)]
+                  for y in range(y0, y1 + 1)]
 
-    for x in range(room_map.size):
-        for y in range(room_map.size):
-            map_array[y][x] = room_map.rooms[(x, y)]
+    for x in range(x0, x1 + 1):
+        for y in range(y0, y1 + 1):
+            map_array[y - y0][x - x0] = room_map.rooms[(x, y)]
+
+    out.write(pformat(map_array) + '\n')
+
+
+class MapRenderer(object):
+    """Draws the part of the map around the current room.
+
+    Only a window of cells within radius of room_map.coord is drawn,
+    so drawing costs the same however large the map is. Rendered
+    cells and rows are cached between frames: after mark()ing the
+    cells that changed, such as the rooms the hero left and entered,
+    only the rows holding those cells are rebuilt.
+    """
 
-    pprint(map_array)
+    def __init__(self, room_map, radius=10):
+        self.room_map = room_map
+        self.radius = radius
+        self._cells = {}
+        self._rows = {}
+        self._window = None
+
+    def mark(self, *coords):
+        """Marks cells as changed, so they are redrawn next frame."""
+
+        for coord in coords:
+            if self._cells.pop(coord, None) is not None:
+                self._rows.pop(coord[1], None)
+
+    def _span(self, centre, low, high):
+        # Fit a window of 2 * radius + 1 cells around centre into
+        # low..high, shifting it inwards at the edges.
+        first = max(low, centre - self.radius)
+        last = min(high, first + 2 * self.radius)
+        first = max(low, last - 2 * self.radius)
+        return first, last
+
+    def window(self):
+        """Returns the (x0, y0, x1, y1) box of cells to draw."""
+
+        bounds = getattr(self.room_map.rooms, 'bounds', None)
+        if bounds is None:
+            bounds = (0, 0, self.room_map.size - 1, self.room_map.size - 1)
+        (x, y) = self.room_map.coord
+        (x0, x1) = self._span(x, bounds[0], bounds[2])
+        (y0, y1) = self._span(y, bounds[1], bounds[3])
+        return x0, y0, x1, y1
+
+    def _cell(self, coord):
+        try:
+            return self._cells[coord]
+        except KeyError:
+            self._cells[coord] = repr(self.room_map.rooms[coord])
+            return self._cells[coord]
+
+    def render(self):
+        """Returns the window of the map as a string."""
+
+        window = self.window()
+        if window != self._window:
+            self._rows = {}
+            self._window = window
+
+        (x0, y0, x1, y1) = window
+        lines = []
+        for y in range(y0, y1 + 1):
+            try:
+                line = self._rows[y]
+            except KeyError:
+                line = ' '.join([self._cell((x, y))
+                                 for x in range(x0, x1 + 1)])
+                self._rows[y] = line
+            lines.append(line)
+        return '\n'.join(lines)
+
+    def draw(self, out=screen):
+        """Writes the window of the map to out."""
+
+        out.write(self.render() + '\n')
@@ -0,0 +1,259 @@
+"""This file works out the exact odds of a fight between the hero and a
+mob of monsters, following the rules of FightEngine.battle(). The odds
+are worked out once by dynamic programming over the (hero hit points,
+monster hit points) states the fight can pass through, then cached.
+"""
+
+import os
+import random
+import cPickle
+from collections import OrderedDict
+from ex45_fight import FightOutcome
+
+
+class Odds(object):
+    """The exact outcome of a fight.
+
+    distribution is a list of (hit points, probability) pairs for the
+    hit points the hero ends the fight with, 0 meaning the hero died.
+    """
+
+    def __init__(self, distribution):
+        self.distribution = sorted(distribution.items())
+        self.win_probability = 1.0 - distribution.get(0, 0.0)
+        self.expected_hit_points = sum(hit_points * probability
+            for hit_points, probability in self.distribution)
+
+    def __repr__(self):
+        return "<%.1f%% to win, %.1f hit points expected>" % (
+            self.win_probability * 100, self.expected_hit_points)
+
+    def sample(self, rng=random):
+        """Draws the hit points the hero ends a fight with."""
+
+        point = rng.random()
+        for hit_points, probability in self.distribution:
+            point -= probability
+            if point < 0:
+                return hit_points
+        return self.distribution[-1][0]
+
+
+class OddsTable(object):
+    """Works out and caches the odds of fights.
+
+    Odds are kept per hero attack and hit points, monster attack and
+    the hit points of each monster in the mob, for the max_entries
+    most recently used fights. If a path is given, the table is
+    loaded from it and save() writes it back, as plain tuples. A table
+    that cannot be read is dropped and starts empty. changed is set
+    once odds have been worked out that the file does not hold.
+    """
+
+    def __init__(self, path=None, max_entries=1024):
+        self.path = path
+        self.max_entries = max_entries
+        self.changed = False
+        self._odds = OrderedDict()
+        self._sums = {}
+        if path is not None:
+            self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, 'rb') as table_file:
+                entries = cPickle.load(table_file)
+            odds = OrderedDict((key, Odds(dict(distribution)))
+                               for key, distribution in entries)
+        except IOError:
+            return
+        except Exception:
+            # Anything can come out of a damaged file, so whatever goes
+            # wrong, the table is dropped and worked out again.
+            os.remove(self.path)
+            return
+        self._odds = odds
+        self._trim()
+
+    def _trim(self):
+        # Drops the least recently used odds beyond max_entries.
+        while len(self._odds) > self.max_entries:
+            self._odds.popitem(last=False)
+
+    def save(self):
+        """Writes the table to its path."""
+
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        temp_path = "%s.%d.tmp" % (self.path, os.getpid())
+        with open(temp_path, 'wb') as table_file:
+            entries = tuple((key, tuple(odds.distribution))
+                            for key, odds in self._odds.iteritems())
+            cPickle.dump(entries, table_file, cPickle.HIGHEST_PROTOCOL)
+        os.rename(temp_path, self.path)
+        self.changed = False
+
+    def odds(self, hero, monsters):
+        """Returns the Odds of hero fighting the monsters.
+
+        All the monsters must share the same attack.
+        """
+
+        attacks = set(monster.attack for monster in monsters)
+        if len(attacks) > 1:
+            raise ValueError("Monsters with different attacks")
+        monster_attack = attacks.pop() if attacks else (0, 0)
+        mob = tuple(sorted(monster.hit_points for monster in monsters))
+        key = (tuple(hero.attack), hero.hit_points, tuple(monster_attack),
+               mob)
+
+        try:
+            odds = self._odds.pop(key)
+        except KeyError:
+            odds = Odds(self._fight(hero.hit_points, mob, tuple(hero.attack),
+                                    tuple(monster_attack)))
+            self.changed = True
+        self._odds[key] = odds
+        self._trim()
+        return odds
+
+    def _damage(self, attack, count):
+        # The distribution of the total damage of count monsters,
+        # each dealing uniform damage in the attack range.
+        try:
+            return self._sums[attack, count]
+        except KeyError:
+            pass
+
+        (low, high) = attack
+        sums = {0: 1.0}
+        hit = 1.0 / (high - low + 1)
+        for i in range(count):
+            new = {}
+            for total, probability in sums.items():
+                for damage in range(low, high + 1):
+                    new[total + damage] = (new.get(total + damage, 0.0) +
+                                           probability * hit)
+            sums = new
+        self._sums[attack, count] = sums.items()
+        return self._sums[attack, count]
+
+    def _hits(self, mob, hero_attack, hits):
+        # The mobs the hero can leave behind with one hit, as a list
+        # of (mob, probability) pairs.
+        try:
+            return hits[mob]
+        except KeyError:
+            pass
+
+        outcomes = {}
+        (low, high) = hero_attack
+        hit = 1.0 / (len(mob) * (high - low + 1))
+        for i, monster_hp in enumerate(mob):
+            if i and monster_hp == mob[i - 1]:
+                # Hitting either of two equal monsters is the same.
+                continue
+            targets = mob.count(monster_hp)
+            rest = mob[:i] + mob[i + targets:] + (monster_hp,) * (targets - 1)
+            for damage in range(low, high + 1):
+                left = rest
+                if monster_hp > damage:
+                    left = rest + (monster_hp - damage,)
+                left = tuple(sorted(left))
+                outcomes[left] = outcomes.get(left, 0.0) + hit * targets
+
+        hits[mob] = outcomes.items()
+        return hits[mob]
+
+    def _fight(self, hit_points, mob, hero_attack, monster_attack):
+        # Returns {final hit points: probability} for the hero with
+        # hit_points facing a mob with the given hit points. Works
+        # forward one round at a time, merging the chances of every
+        # way to reach the same (hit points, mob) state, until every
+        # fight has ended.
+        result = {}
+        states = {(hit_points, mob): 1.0}
+        hits = {}
+        while states:
+            later = {}
+            for (hit_points, mob), chance in states.iteritems():
+                if not mob:
+                    result[hit_points] = result.get(hit_points, 0.0) + chance
+                    continue
+                for left, hit_chance in self._hits(mob, hero_attack, hits):
+                    if not left:
+                        result[hit_points] = (result.get(hit_points, 0.0) +
+                                              chance * hit_chance)
+                        continue
+
+                    # Every monster left standing hits back.
+                    for taken, taken_chance in self._damage(monster_attack,
+                                                            len(left)):
+                        probability = chance * hit_chance * taken_chance
+                        if taken >= hit_points:
+                            result[0] = result.get(0, 0.0) + probability
+                        else:
+                            state = (hit_points - taken, left)
+                            later[state] = later.get(state, 0.0) + probability
+            states = later
+        return result
+
+
+# Where the table shared by the game is kept, if anywhere, and the
+# table itself, which is only opened by the first fight.
+_table_path = None
+_table = None
+
+
+def keep_table(path):
+    """Keeps the table shared by the game at path. It is loaded from
+    there by the first fight, and written back by save_table().
+    """
+
+    global _table_path
+    _table_path = path
+
+
+def shared_table():
+    """Returns the table shared by the game, opening it if need be."""
+
+    global _table
+    if _table is None:
+        _table = OddsTable(_table_path)
+    return _table
+
+
+def save_table():
+    """Writes the shared table to its path, if it has one and has
+    learned anything.
+    """
+
+    if _table is not None and _table.path is not None and _table.changed:
+        _table.save()
+
+
+def resolve(hero, monsters, table=None, rng=random):
+    """Settles a fight at once by sampling its exact outcome.
+
+    Rather than playing out every hit, the hero's final hit points are
+    drawn from the fight's odds, from the shared table unless another
+    is given. If the hero wins, the monsters are killed and the
+    monsters list is emptied. Returns a FightOutcome without rounds or
+    a log.
+    """
+
+    if table is None:
+        table = shared_table()
+    outcome = FightOutcome(hero, monsters)
+    hero.hit_points = table.odds(hero, monsters).sample(rng)
+    if hero.hit_points > 0:
+        # As in battle(), so monsters kept in a MonsterStore are marked
+        # dead there too.
+        for monster in monsters:
+            monster.hit_points = 0
+        del monsters[:]
+        outcome.survivor = 'hero'
+    else:
+        outcome.survivor = 'monsters'
+    return outcome
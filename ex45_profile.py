@@ -0,0 +1,171 @@
+"""This file times the phases of a game and counts calls to its hot
+functions, for ex45_main.py's --profile option. Nothing here is
+installed unless profiling is asked for, so an unprofiled game runs
+exactly as it would without this file.
+
+The report is JSON:
+
+    {"phases": {name: {"calls", "wall", "cpu", "first_wall"}},
+     "counters": {name: calls},
+     "peak_kb": peak memory of the process,
+     "tracemalloc": [the largest allocation sites] or null}
+"""
+
+import resource
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import wraps
+
+
+class Profiler(object):
+    """Collects wall and CPU time per phase, and call counts.
+
+    Phases are timed with phase(), or by wrapping a function with
+    timed() so that every call to it is added to its phase. Functions
+    wrapped with counted() only have their calls counted, which costs
+    far less on functions called many times. With trace_memory, the
+    largest allocation sites are recorded too, where tracemalloc is
+    available. Phases may be timed from more than one thread, but are
+    not told apart by thread.
+    """
+
+    def __init__(self, trace_memory=False):
+        import threading
+        self._lock = threading.Lock()
+        self.phases = OrderedDict()
+        self.counters = OrderedDict()
+        self._scope = ''
+        self._patches = []
+        self._tracemalloc = None
+        if trace_memory:
+            try:
+                import tracemalloc
+            except ImportError:
+                pass
+            else:
+                tracemalloc.start()
+                self._tracemalloc = tracemalloc
+
+    def _add(self, name, wall, cpu):
+        with self._lock:
+            try:
+                record = self.phases[name]
+            except KeyError:
+                record = self.phases[name] = {'calls': 0, 'wall': 0.0,
+                                              'cpu': 0.0, 'first_wall': wall}
+            record['calls'] += 1
+            record['wall'] += wall
+            record['cpu'] += cpu
+
+    @contextmanager
+    def phase(self, name):
+        """Times the body of a with statement as phase name, within
+        the scope of any scoped phase it runs in.
+        """
+
+        name = self._scope + name
+        (wall, cpu) = (time.time(), time.clock())
+        try:
+            yield
+        finally:
+            self._add(name, time.time() - wall, time.clock() - cpu)
+
+    def _patch(self, owner, name, wrapper):
+        original = getattr(owner, name)
+        self._patches.append((owner, name, owner.__dict__.get(name)))
+        setattr(owner, name, wraps(original)(wrapper(original)))
+
+    def timed(self, owner, name, phase=None, scoped=False):
+        """Replaces owner.name, a module's function or an object's
+        method, with one that adds each call to a phase, named after
+        the function by default. If scoped, phases timed during the
+        call are kept apart from the rest, as 'phase/name'.
+        """
+
+        phase = phase or name
+        def wrapper(original):
+            def timed_call(*args, **kwargs):
+                with self.phase(phase):
+                    if not scoped:
+                        return original(*args, **kwargs)
+                    outer = self._scope
+                    self._scope = "%s%s/" % (outer, phase)
+                    try:
+                        return original(*args, **kwargs)
+                    finally:
+                        self._scope = outer
+            return timed_call
+        self._patch(owner, name, wrapper)
+
+    def counted(self, owner, name, counter=None):
+        """Replaces owner.name with one that counts its calls."""
+
+        counter = counter or name
+        self.counters.setdefault(counter, 0)
+        counters = self.counters
+        def wrapper(original):
+            def counted_call(*args, **kwargs):
+                counters[counter] += 1
+                return original(*args, **kwargs)
+            return counted_call
+        self._patch(owner, name, wrapper)
+
+    def remove(self):
+        """Puts back everything timed() and counted() replaced."""
+
+        while self._patches:
+            (owner, name, original) = self._patches.pop()
+            if original is None:
+                delattr(owner, name)
+            else:
+                setattr(owner, name, original)
+
+    def report(self):
+        """Returns the results as a dictionary."""
+
+        allocations = None
+        if self._tracemalloc is not None:
+            snapshot = self._tracemalloc.take_snapshot()
+            allocations = [{'site': str(stat.traceback),
+                            'kb': stat.size / 1024.0,
+                            'blocks': stat.count}
+                           for stat in snapshot.statistics('lineno')[:20]]
+        return {'phases': self.phases,
+                'counters': self.counters,
+                'peak_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                'tracemalloc': allocations}
+
+    def write(self, path):
+        """Writes the report to path as JSON."""
+
+        import json
+        with open(path, 'w') as report_file:
+            json.dump(self.report(), report_file, indent=1)
+            report_file.write('\n')
+
+
+@contextmanager
+def no_phase(name):
+    """Stands in for Profiler.phase() when not profiling."""
+    yield
+
+
+def install_game_hooks(profiler):
+    """Times the map generation phases, map drawing and descents to
+    deeper levels, and counts calls to the hot functions of map
+    generation. Deeper levels are generated within their descent, so
+    their phases are kept apart under 'descend/'.
+    """
+
+    import ex45_map
+    from ex45_engines import RoomEngine, GameEngine
+
+    for name in ('create_map', 'seed_map', 'generate_map',
+                 'fill_empty_rooms'):
+        profiler.timed(ex45_map, name)
+    profiler.timed(ex45_map.MapRenderer, 'draw', 'draw_map')
+    profiler.timed(GameEngine, 'descend', scoped=True)
+    for name in ('complete_room', 'next_future_room', 'check_map'):
+        profiler.counted(ex45_map, name)
+    profiler.counted(RoomEngine, 'add_room')
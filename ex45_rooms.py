@@ -5,23 +5,37 @@ to the game map.
 
 
 import sys
-from ex45_text import get_input
-from ex45_engines import FightEngine
-from ex45_chars import GenericMonster
+from ex45_text import interactive, screen
+from ex45_fight import FightEngine
 
 
-def fight_or_flee():
+# The move LastRoom.enter() makes to take the hero down a level. It is
+# not a string, so no input can ever be mistaken for it.
+DESCEND = object()
 
-    print "Will you fight or flee?"
+
+def fight_or_flee(source=interactive, hero=None, monsters=None, out=screen):
+
+    if hero is not None and monsters:
+        # Only games with fights need the odds.
+        import ex45_odds
+        odds = ex45_odds.shared_table().odds(hero, monsters)
+        out.say("Odds of victory: %d%%, with about %d hit points left" % (
+            round(odds.win_probability * 100),
+            odds.expected_hit_points / max(odds.win_probability, 0.01)))
+    out.say("Will you fight or flee? ('auto' settles the fight at once)")
     while True:
-        choice = get_input()
-        print choice
+        choice = source.get_input()
+        out.say(choice)
         if 'flee' in choice.lower():
             return 'flee'
         elif 'fight' in choice.lower():
             return 'fight'
+        elif 'auto' in choice.lower():
+            return 'auto'
         else:
-            print "Please enter a valid choice to 'fight' or 'flee'"
+            out.say("Please enter a valid choice to 'fight', 'flee' or "
+                    "'auto'")
     return choice
 
 
@@ -36,6 +50,14 @@ class Room(object):
     methods for looking up and adding doors
     """
 
+    # Rooms keep their state in slots rather than an instance dict,
+    # which matters on large maps. What every room of a type shares
+    # is held on its class.
+    __slots__ = ('doors', 'room_number', 'current_room', '_first_visit',
+                 'monsters')
+
+    real = True
+
     # This tuple mirror-maps the door numbers to easily give
     # access to a neighboring room's adjacent door.
     opp_doors = (2, 3, 0, 1)
@@ -43,7 +65,6 @@ class Room(object):
     def __init__(self, room_number):
         self.doors = [0, 0, 0, 0, 1]    # Fifth 'door' allows player to stay.
         self.room_number = room_number
-        self.real = True
         self.current_room = False
         self._first_visit = True
         self.monsters = []
@@ -75,37 +96,50 @@ class Room(object):
 
 class TombRoom(Room):
     """This room contains a sarcophagus. A mummy will pop out of
-    it to attack the player.
+    it to attack the player. populate_map() puts the mummy in the
+    room's monsters, but it is only seen on the first visit.
     """
 
+    __slots__ = ('sarcophagus',)
+
+    room_type = 'TombRoom'
+    other_enemies = 'no'
+
     def __init__(self, room_number):
         super(TombRoom, self).__init__(room_number)
-        self.room_type = 'TombRoom'
-        self. sarcophagus = 'closed'
-        self.other_enemies = 'no'
+        self.sarcophagus = 'closed'
 
-    def enter(self, hero):
+    def enter(self, hero, source=interactive, out=screen):
         # For debugging, have the room tell me where I am and
         # what doors are available.
-        print "Tomb room %d" % self.room_number
+        out.say("Tomb room %d" % self.room_number)
         if self._first_visit == True:
             self._first_visit = False
             self.sarcophagus = 'open'
-            print "There's a mummy crawling out of a sarcophagus!"
-            self.monsters.append(GenericMonster(0))
-        print self.monsters
+            out.say("There's a mummy crawling out of a sarcophagus!")
+        out.say(self.monsters)
         if self.monsters:
-            choice = fight_or_flee()
-            if choice == 'fight':
-                (hero, monsters) = FightEngine.battle(hero, self.monsters)
-                print "You have %d hit points remaining" % hero.hit_points
-                raw_input("You won! Press enter to continue.")
+            choice = fight_or_flee(source, hero, self.monsters, out)
+            if choice == 'auto':
+                # Skip the blow by blow and draw the outcome from the
+                # fight's exact odds.
+                import ex45_odds
+                outcome = ex45_odds.resolve(hero, self.monsters)
+            elif choice == 'fight':
+                outcome = FightEngine.battle(hero, self.monsters, out=out)
+            if choice in ('auto', 'fight'):
+                if outcome.survivor != 'hero':
+                    out.say("You died!")
+                    out.flush()
+                    sys.exit(0)
+                out.say("You have %d hit points remaining" % hero.hit_points)
+                source.get_line("You won! Press enter to continue.")
                 move = 4
             if choice == 'flee':
                 move = self.opp_doors[hero.direction]
         else:
-            print "Valid doors:", self.which_doors()
-            move = get_input()
+            out.say("Valid doors:", self.which_doors())
+            move = source.get_input()
         return move, hero
 
     def __repr__(self):
@@ -123,19 +157,22 @@ class HealingRoom(Room):
     used once.
     """
 
+    __slots__ = ('fountain',)
+
+    room_type = 'HealingRoom'
+    other_enemies = 'no'
+
     def __init__(self, room_number):
         super(HealingRoom, self).__init__(room_number)
-        self.room_type = 'HealingRoom'
-        self.other_enemies = 'no'
         self.fountain = 'unused'
 
-    def enter(self, hero):
+    def enter(self, hero, source=interactive, out=screen):
         # For debugging, have the room tell me where I am and
         # what doors are available.
         self._first_visit = False
-        print "Healing room %d" % self.room_number
-        print "Valid doors:", self.which_doors()
-        move = get_input()
+        out.say("Healing room %d" % self.room_number)
+        out.say("Valid doors:", self.which_doors())
+        move = source.get_input()
         return move, hero
 
     def __repr__(self):
@@ -150,18 +187,18 @@ class HealingRoom(Room):
 class PlainRoom(Room):
     """This plain room can contain any sort of monster."""
 
-    def __init__(self, room_number):
-        super(PlainRoom, self).__init__(room_number)
-        self.room_type = 'PlainRoom'
-        self.other_enemies = 'yes'
+    __slots__ = ()
+
+    room_type = 'PlainRoom'
+    other_enemies = 'yes'
 
-    def enter(self, hero):
+    def enter(self, hero, source=interactive, out=screen):
         # For debugging, have the room tell me where I am and
         # what doors are available.
         self._first_visit = False
-        print "Plain room %d" % self.room_number
-        print "Valid doors:", self.which_doors()
-        move = get_input()
+        out.say("Plain room %d" % self.room_number)
+        out.say("Valid doors:", self.which_doors())
+        move = source.get_input()
         return move, hero
 
     def __repr__(self):
@@ -179,19 +216,22 @@ class PrisonRoom(Room):
     the monster for chance at great reward!
     """
 
+    __slots__ = ('prison_cell',)
+
+    room_type = 'PrisonRoom'
+    other_enemies = 'no'
+
     def __init__(self, room_number):
         super(PrisonRoom, self).__init__(room_number)
-        self.room_type = 'PrisonRoom'
-        self.other_enemies = 'no'
         self.prison_cell = 'closed'
 
-    def enter(self, hero):
+    def enter(self, hero, source=interactive, out=screen):
         # For debugging, have the room tell me where I am and
         # what doors are available.
         self._first_visit = False
-        print "Prison room %d" % self.room_number
-        print "Valid doors:", self.which_doors()
-        move = get_input()
+        out.say("Prison room %d" % self.room_number)
+        out.say("Valid doors:", self.which_doors())
+        move = source.get_input()
         return move, hero
 
     def __repr__(self):
@@ -208,18 +248,18 @@ class TortureRoom(Room):
     A bit more gruesome than the plain room.
     """
 
-    def __init__(self, room_number):
-        super(TortureRoom, self).__init__(room_number)
-        self.room_type = 'TortureRoom'
-        self.other_enemies = 'yes'
+    __slots__ = ()
+
+    room_type = 'TortureRoom'
+    other_enemies = 'yes'
 
-    def enter(self, hero):
+    def enter(self, hero, source=interactive, out=screen):
         # For debugging, have the room tell me where I am and
         # what doors are available.
         self._first_visit = False
-        print "Torture room %d" % self.room_number
-        print "Valid doors:", self.which_doors()
-        move = get_input()
+        out.say("Torture room %d" % self.room_number)
+        out.say("Valid doors:", self.which_doors())
+        move = source.get_input()
         return move, hero
 
     def __repr__(self):
@@ -236,17 +276,17 @@ class FirstRoom(Room):
     There will be no enemies in this room.
     """
 
-    def __init__(self, room_number):
-        super(FirstRoom, self).__init__(room_number)
-        self.room_type = 'FirstRoom'
-        self.first_room = True
-        self.other_enemies = 'no'
+    __slots__ = ()
+
+    room_type = 'FirstRoom'
+    first_room = True
+    other_enemies = 'no'
 
-    def enter(self, hero):
+    def enter(self, hero, source=interactive, out=screen):
         self._first_visit = False
-        print "First room!"
-        print "Valid doors:", self.which_doors()
-        move = get_input()
+        out.say("First room!")
+        out.say("Valid doors:", self.which_doors())
+        move = source.get_input()
         return move, hero
 
     def __repr__(self):
@@ -257,21 +297,22 @@ class FirstRoom(Room):
 
 
 class LastRoom(Room):
-    """This is last room, where the hero ends the quest or possibly
-    chooses to descend to a lower, more difficult level. Maybe there
-    could be a boss in this room.
+    """This is last room, where the hero descends to a lower, more
+    difficult level, or leaves the dungeon if there are no more
+    levels. Maybe there could be a boss in this room.
     """
 
-    def __init__(self, room_number):
-        super(LastRoom, self).__init__(room_number)
-        self.room_type = 'LastRoom'
-        self.last_room = True
-        self.other_enemies = 'no'
+    __slots__ = ()
+
+    room_type = 'LastRoom'
+    last_room = True
+    other_enemies = 'no'
 
-    def enter(self, hero):
+    def enter(self, hero, source=interactive, out=screen):
+        # Nothing is said here, as the screen is cleared before the
+        # next move; GameEngine.descend() tells the hero what happened.
         self._first_visit = False
-        print "Last room!"
-        sys.exit(0)
+        return DESCEND, hero
 
     def __repr__(self):
         if self.current_room == True:
@@ -282,51 +323,78 @@ class LastRoom(Room):
             return "La"
 
 
-class EmptyRoom(object):
+class Placeholder(object):
+    """Parent class for the dummy rooms that fill the map.
+
+    Dummy rooms have no state, so each type only ever has one
+    instance, shared by every cell of that type: calling the class
+    again returns the same object.
+    """
+
+    __slots__ = ()
+
+    real = False
+    other_enemies = 'no'
+
+    def __new__(cls):
+        instance = cls.__dict__.get('_instance')
+        if instance is None:
+            instance = super(Placeholder, cls).__new__(cls)
+            cls._instance = instance
+        return instance
+
+
+class EmptyRoom(Placeholder):
     """This is a dummy-object, used to fill out the map upon creation."""
 
-    def __init__(self):
-        self.room_type = 'EmptyRoom'
-        self.real = False
+    __slots__ = ()
+
+    room_type = 'EmptyRoom'
 
     def __repr__(self):
         return "_e"
 
 
-class FutureRoom(object):
+class FutureRoom(Placeholder):
     """This is a dummy-object, used a place holder for rooms that
     need to be handled.
     """
 
-    def __init__(self):
-        self.room_type = 'FutureRoom'
-        self.real = False
+    __slots__ = ()
+
+    room_type = 'FutureRoom'
 
     def __repr__(self):
         return "_u"
 
 
-class NonRoom(object):
+class NonRoom(Placeholder):
     """This is a dummy-object, used to make the final map pprint-able."""
 
-    def __init__(self):
-        self.room_type = 'NonRoom'
-        self.real = False
-        self.other_enemies = 'no'
+    __slots__ = ()
+
+    room_type = 'NonRoom'
 
     def __repr__(self):
         return "__"
 
 
-class CurrentRoom(object):
+class CurrentRoom(Placeholder):
     """This is a dummy-object, to be put in the place of the current room
     until all doors and neighboor rooms are handled, and the real room
     can be instantiated.
     """
 
-    def __init__(self):
-        self.room_type = 'CurrentRoom'
-        self.real = False
+    __slots__ = ()
+
+    room_type = 'CurrentRoom'
 
     def __repr__(self):
         return "_c"
+
+
+# Every room class by name, the names used as room types by
+# RoomEngine and ex45_grid.ROOM_TYPES.
+ROOM_CLASSES = dict((room_class.__name__, room_class) for room_class in (
+    EmptyRoom, NonRoom, FutureRoom, CurrentRoom, FirstRoom, LastRoom,
+    TombRoom, PlainRoom, TortureRoom, PrisonRoom, HealingRoom))
@@ -0,0 +1,163 @@
+"""This file finds routes through the doors of a generated map, so that
+the hero, or a bot, can travel to a room without searching the map at
+every step.
+
+Routes are worked out by a breadth-first search back from the room
+being travelled to, which gives every room that can reach it a
+distance and the door to leave by. Once that field is built, each hop
+of a route is a single lookup.
+"""
+
+from collections import OrderedDict, deque
+import ex45_grid
+
+
+# How each door shifts the coordinates, as in RoomEngine._direction.
+_SHIFTS = ((0, -1), (1, 0), (0, 1), (-1, 0))
+
+
+class RouteIndex(object):
+    """Shortest routes between the rooms of a room_map.
+
+    The doors of every real room are read once, when the index is
+    built. A field is then built for each place travelled to, holding
+    (distance, door, goal) for every room with a route there, and the
+    max_fields most recently used fields are kept. If a room changes,
+    update_room() replaces its doors and drops the fields.
+    """
+
+    def __init__(self, room_map, max_fields=64):
+        self.room_map = room_map
+        self.max_fields = max_fields
+        self._doors = {}
+        self._numbers = {}
+        self._last_room = None
+        self._fields = OrderedDict()
+        self._unvisited = None
+        for coord, cell in ex45_grid.real_cells(room_map):
+            self._add(coord, cell)
+
+    def _add(self, coord, cell):
+        room_type = ex45_grid.ROOM_TYPES[cell & 0x0f]
+        self._doors[coord] = cell >> 4
+        room = self.room_map.rooms[coord]
+        self._numbers[room.room_number] = coord
+        if room_type == 'LastRoom':
+            self._last_room = coord
+
+    def update_room(self, coord):
+        """Reads the doors of the room at coord again, after it has
+        been replaced or its doors have changed.
+        """
+
+        old = self._doors.pop(coord, None)
+        if old is not None:
+            for number, found in self._numbers.items():
+                if found == coord:
+                    del self._numbers[number]
+            if self._last_room == coord:
+                self._last_room = None
+        room = self.room_map.rooms[coord]
+        if room.real:
+            self._add(coord, ex45_grid.cell_byte(room))
+        self.invalidate()
+
+    def invalidate(self):
+        """Drops every field, so that routes are worked out afresh."""
+
+        self._fields.clear()
+        self._unvisited = None
+
+    def room_coord(self, number):
+        """Returns the coordinates of room number, or None."""
+
+        return self._numbers.get(number)
+
+    def last_room(self):
+        """Returns the coordinates of the last room, or None."""
+
+        return self._last_room
+
+    def _search(self, goals):
+        # Breadth-first search back from the goals. A room at p leads
+        # into coord when p has a door towards coord.
+        field = {}
+        queue = deque()
+        for goal in goals:
+            field[goal] = (0, None, goal)
+            queue.append(goal)
+
+        doors = self._doors
+        while queue:
+            coord = queue.popleft()
+            (distance, door, goal) = field[coord]
+            for direction, (dx, dy) in enumerate(_SHIFTS):
+                previous = (coord[0] - dx, coord[1] - dy)
+                if (previous not in field and
+                        doors.get(previous, 0) & 1 << direction):
+                    field[previous] = (distance + 1, direction, goal)
+                    queue.append(previous)
+        return field
+
+    def field(self, target):
+        """Returns the field of routes to the room at target."""
+
+        try:
+            field = self._fields.pop(target)
+        except KeyError:
+            field = self._search([target] if target in self._doors else [])
+        self._fields[target] = field
+        while len(self._fields) > self.max_fields:
+            self._fields.popitem(last=False)
+        return field
+
+    def distance(self, coord, target):
+        """Returns the number of moves from coord to target, or None
+        if there is no route.
+        """
+
+        entry = self.field(target).get(coord)
+        return entry[0] if entry is not None else None
+
+    def next_hop(self, coord, target):
+        """Returns the door to leave coord by to head for target, or
+        None at the target or without a route.
+        """
+
+        entry = self.field(target).get(coord)
+        return entry[1] if entry is not None else None
+
+    def route(self, coord, target):
+        """Returns the list of doors to take from coord to target.
+
+        The list is empty at the target or if there is no route.
+        """
+
+        field = self.field(target)
+        doors = []
+        entry = field.get(coord)
+        while entry is not None and entry[1] is not None:
+            doors.append(entry[1])
+            (dx, dy) = _SHIFTS[entry[1]]
+            coord = (coord[0] + dx, coord[1] + dy)
+            entry = field[coord]
+        return doors
+
+    def nearest_unvisited(self, coord):
+        """Returns (distance, door, room) for the nearest room the
+        hero has not visited yet, or None if none can be reached.
+
+        The field is only searched again once the room it leads to
+        has been visited.
+        """
+
+        rooms = self.room_map.rooms
+        if self._unvisited is not None:
+            entry = self._unvisited.get(coord)
+            if entry is not None and rooms[entry[2]]._first_visit:
+                return entry
+
+        goals = [room_coord for room_coord in self._doors
+                 if rooms[room_coord]._first_visit]
+        self._unvisited = self._search(goals)
+        return self._unvisited.get(coord)
@@ -0,0 +1,339 @@
+"""This file saves games in progress to compact binary snapshots and
+resumes them. A snapshot holds the map, where the hero is, every real
+room's state and monsters, and the hero's hit points and direction.
+
+A snapshot is laid out as:
+
+    SAVE_HEADER     magic, format version, map size, current and
+                    starting coordinates, bounds of the rooms, room
+                    and monster counts, hero hit points and direction,
+                    the level, the size of the dungeon's first level,
+                    and the level's seed with a flag set if it has one
+    ROOM_STATE      one per real room, sorted by cell index
+                    (y * size + x): the index, room number, cell byte
+                    as packed by ex45_grid.cell_byte(), STATE_FLAGS,
+                    and the room's count and first entry of monsters
+    MONSTER_STATE   one per monster: hit points, number, attack range
+                    and maximum hit points
+
+Rooms are fixed size records sorted by cell index, so a resumed game
+reads the snapshot through mmap and only turns a record into a room
+when that room is looked at.
+"""
+
+import os
+import mmap
+import struct
+import ex45_grid
+import ex45_rooms
+from ex45_engines import RoomEngine
+from ex45_chars import Hero
+
+
+SAVE_MAGIC = 'X45S'
+SAVE_VERSION = 2
+SAVE_HEADER = struct.Struct('<4sHIIIIIiiiiIIiBIIqB')
+ROOM_STATE = struct.Struct('<QIBBHI')
+MONSTER_STATE = struct.Struct('<iHiii')
+
+# Bit i of a room's flags is set when the room's attribute holds the
+# second value rather than the first. Rooms without the attribute
+# leave the bit clear.
+STATE_FLAGS = (('_first_visit', False, True),
+               ('current_room', False, True),
+               ('sarcophagus', 'closed', 'open'),
+               ('fountain', 'unused', 'used'),
+               ('prison_cell', 'closed', 'open'))
+
+
+class SnapshotError(ValueError):
+    """Raised when a file is not a snapshot this version can read."""
+
+
+def _flags(room):
+    flags = 0
+    for bit, (name, off, on) in enumerate(STATE_FLAGS):
+        if getattr(room, name, off) == on:
+            flags |= 1 << bit
+    return flags
+
+
+def _monster_states(monsters):
+    # The MONSTER_STATE fields of each monster.
+    return [(monster.hit_points, int(monster.number), monster.attack[0],
+             monster.attack[1], monster.max_hit_points)
+            for monster in monsters]
+
+
+def _room_states(room_map):
+    # Yields (index, number, cell, flags, monsters) for every real
+    # room, where monsters is a list of MONSTER_STATE fields.
+    rooms = room_map.rooms
+    if isinstance(rooms, SnapshotGrid):
+        # Rooms never looked at are copied without building them.
+        for state in rooms.states():
+            yield state
+        return
+
+    size = room_map.size
+    for (x, y), cell in ex45_grid.real_cells(room_map):
+        room = rooms[(x, y)]
+        yield (y * size + x, room.room_number, cell, _flags(room),
+               _monster_states(room.monsters))
+
+
+def save_game(path, room_map, hero):
+    """Writes a snapshot of room_map and hero to path."""
+
+    size = room_map.size
+    states = sorted(_room_states(room_map))
+
+    rooms = []
+    monsters = []
+    (x0, y0, x1, y1) = (size, size, -1, -1)
+    for index, number, cell, flags, room_monsters in states:
+        rooms.append(ROOM_STATE.pack(index, number, cell, flags,
+                                     len(room_monsters), len(monsters)))
+        monsters.extend(MONSTER_STATE.pack(*monster)
+                        for monster in room_monsters)
+        (y, x) = divmod(index, size)
+        (x0, y0, x1, y1) = (min(x0, x), min(y0, y), max(x1, x), max(y1, y))
+
+    header = SAVE_HEADER.pack(SAVE_MAGIC, SAVE_VERSION, size,
+        room_map.coord[0], room_map.coord[1],
+        room_map.init_coord[0], room_map.init_coord[1],
+        x0, y0, x1, y1, len(rooms), len(monsters),
+        hero.hit_points, hero.direction, room_map.level,
+        room_map.first_size or size, room_map.seed or 0,
+        room_map.seed is not None)
+
+    # Write to a temporary file first, so a crash part way through
+    # never leaves a damaged save behind.
+    temp_path = path + '.tmp'
+    with open(temp_path, 'wb') as save_file:
+        save_file.write(header)
+        save_file.write(''.join(rooms))
+        save_file.write(''.join(monsters))
+    os.rename(temp_path, path)
+
+
+def load_game(path):
+    """Resumes the snapshot at path.
+
+    Returns (room_map, hero). The rooms of room_map are a SnapshotGrid
+    reading from the file, so rooms are only built as the game
+    reaches them, and their monsters are only added to the room_map's
+    monster_store then. The room_map's level, first_size and seed are
+    those it was saved with.
+    """
+
+    with open(path, 'rb') as save_file:
+        data = mmap.mmap(save_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    # The magic and version come first in every version of the format.
+    if len(data) < 6:
+        raise SnapshotError("%s is too short to be a snapshot" % path)
+    (magic, version) = struct.unpack_from('<4sH', data)
+    if magic != SAVE_MAGIC:
+        raise SnapshotError("%s is not a snapshot" % path)
+    if version != SAVE_VERSION:
+        raise SnapshotError("%s is snapshot version %d, not %d" % (path,
+            version, SAVE_VERSION))
+    if len(data) < SAVE_HEADER.size:
+        raise SnapshotError("%s is too short to be a snapshot" % path)
+    (magic, version, size, x, y, init_x, init_y, x0, y0, x1, y1, count,
+     monster_count, hit_points, direction, level, first_size, seed,
+     seeded) = SAVE_HEADER.unpack_from(data)
+    length = (SAVE_HEADER.size + count * ROOM_STATE.size +
+              monster_count * MONSTER_STATE.size)
+    if len(data) != length:
+        raise SnapshotError("%s is damaged" % path)
+
+    room_map = RoomEngine(size, 'sparse', seed if seeded else None)
+    room_map.level = level
+    if level > 1:
+        room_map.first_size = first_size
+    room_map.rooms = SnapshotGrid(size, data, count, room_map.monster_store)
+    if count:
+        room_map.rooms.bounds = (x0, y0, x1, y1)
+    room_map.coord = (x, y)
+    room_map.init_coord = (init_x, init_y)
+
+    hero = Hero()
+    hero.hit_points = hit_points
+    hero.direction = direction
+    return room_map, hero
+
+
+class SnapshotGrid(object):
+    """A dict-like map of (x, y) coordinates to rooms, read from a
+    snapshot.
+
+    Real rooms are found by a binary search of the snapshot's sorted
+    room records, and are only instantiated the first time they are
+    looked up, then kept so the hero and monsters can change them.
+    Every other cell is a shared non-room. Iterating goes over the
+    real rooms only, in cell order.
+    """
+
+    prefilled = True
+
+    def __init__(self, size, data, count, monster_store):
+        self.size = size
+        self.bounds = None
+        self.monster_store = monster_store
+        self._data = data
+        self._count = count
+        self._monsters = SAVE_HEADER.size + count * ROOM_STATE.size
+        self._rooms = {}
+        self._non_room = ex45_rooms.NonRoom()
+
+    def _index(self, coord):
+        (x, y) = coord
+        if not (0 <= x < self.size and 0 <= y < self.size):
+            raise KeyError(coord)
+        return y * self.size + x
+
+    def _record(self, i):
+        return ROOM_STATE.unpack_from(self._data,
+                                      SAVE_HEADER.size + i * ROOM_STATE.size)
+
+    def _find(self, index):
+        # Binary search of the room records for a cell index.
+        (low, high) = (0, self._count)
+        while low < high:
+            middle = (low + high) // 2
+            (found,) = struct.unpack_from('<Q', self._data,
+                SAVE_HEADER.size + middle * ROOM_STATE.size)
+            if found < index:
+                low = middle + 1
+            elif found > index:
+                high = middle
+            else:
+                return self._record(middle)
+        return None
+
+    def _monster_states(self, first, count):
+        return [MONSTER_STATE.unpack_from(self._data,
+                    self._monsters + i * MONSTER_STATE.size)
+                for i in range(first, first + count)]
+
+    def _build(self, record):
+        (index, number, cell, flags, count, first) = record
+        room_type = ex45_grid.ROOM_TYPES[cell & 0x0f]
+        room = ex45_rooms.ROOM_CLASSES[room_type](number)
+        for i in range(4):
+            if cell >> 4 & 1 << i:
+                room.create_door(i)
+        for bit, (name, off, on) in enumerate(STATE_FLAGS):
+            if hasattr(room, name):
+                setattr(room, name, on if flags & 1 << bit else off)
+        store = self.monster_store
+        first_monster = store.allocate([index], [count])
+        for i, (hit_points, monster_number, attack_low, attack_high,
+                max_hit_points) in enumerate(
+                    self._monster_states(first, count), first_monster):
+            store.hit_points[i] = hit_points
+            store.max_hit_points[i] = max_hit_points
+            store.attack_low[i] = attack_low
+            store.attack_high[i] = attack_high
+            store.numbers[i] = monster_number
+            store.alive[i] = hit_points > 0
+        room.monsters.extend(store.views(first_monster, count))
+        return room
+
+    def __getitem__(self, coord):
+        index = self._index(coord)
+        try:
+            return self._rooms[index]
+        except KeyError:
+            pass
+
+        record = self._find(index)
+        if record is None:
+            return self._non_room
+        self._rooms[index] = self._build(record)
+        return self._rooms[index]
+
+    def __setitem__(self, coord, room):
+        raise TypeError("Snapshot maps cannot be changed")
+
+    def __contains__(self, coord):
+        try:
+            self._index(coord)
+        except (KeyError, TypeError, ValueError):
+            return False
+        return True
+
+    def __len__(self):
+        return self._count
+
+    def __iter__(self):
+        for i in xrange(self._count):
+            (y, x) = divmod(self._record(i)[0], self.size)
+            yield (x, y)
+
+    def keys(self):
+        return list(self)
+
+    def iteritems(self):
+        for coord in self:
+            yield coord, self[coord]
+
+    def items(self):
+        return list(self.iteritems())
+
+    def values(self):
+        return [room for coord, room in self.iteritems()]
+
+    def get(self, coord, default=None):
+        try:
+            return self[coord]
+        except KeyError:
+            return default
+
+    def states(self):
+        """Yields the state of every room as _room_states() does,
+        from the room itself if it was looked at and from its record
+        if not.
+        """
+
+        for i in xrange(self._count):
+            record = self._record(i)
+            (index, number, cell, flags, count, first) = record
+            room = self._rooms.get(index)
+            if room is None:
+                yield (index, number, cell, flags,
+                       self._monster_states(first, count))
+            else:
+                yield (index, number, cell, _flags(room),
+                       _monster_states(room.monsters))
+
+    def real_cells(self):
+        """Yields ((x, y), cell byte) for every real room, straight
+        from the room records.
+        """
+
+        for i in xrange(self._count):
+            (index, number, cell) = self._record(i)[:3]
+            room = self._rooms.get(index)
+            if room is not None:
+                cell = ex45_grid.cell_byte(room)
+            yield (index % self.size, index // self.size), cell
+
+    def rows(self):
+        """Yields each row of the map as a bytearray of cell bytes,
+        straight from the room records.
+        """
+
+        blank = bytearray([ex45_grid.TYPE_CODES['NonRoom']]) * self.size
+        i = 0
+        for y in xrange(self.size):
+            row = blank[:]
+            while i < self._count:
+                (index, number, cell) = self._record(i)[:3]
+                if index // self.size != y:
+                    break
+                row[index % self.size] = cell
+                i += 1
+            yield row
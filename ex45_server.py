@@ -0,0 +1,294 @@
+"""This file hosts many games at once over TCP, each player with their own
+dungeon and hero, from a single event loop. Connect with telnet or nc:
+
+    python ex45_server.py serve --port 4545 --size 10
+    telnet localhost 4545
+
+and measure it with the load test client, which plays with many bots
+at once and reports moves per second and move latency:
+
+    python ex45_server.py load --port 4545 --clients 1000 --moves 50
+
+Python 2 has no asyncio, so the loop is built on asyncore and
+asynchat.
+"""
+
+import argparse
+import asynchat
+import asyncore
+import random
+import socket
+import time
+from collections import deque
+from ex45_engines import RoomEngine, GameEngine
+from ex45_map import build_map
+from ex45_chars import populate_map
+from ex45_levels import LevelLoader
+from ex45_text import InputSource, OutputSink, TerminalOutput
+
+
+class InputPending(Exception):
+    """Raised when a session needs input its player has not sent yet."""
+
+
+class SessionOutput(OutputSink):
+    """Collects a session's output until it is sent to the player.
+
+    While a turn is played again, its output is held back by hold()
+    until SessionInput knows whether the player has seen it already.
+    """
+
+    def __init__(self):
+        self.chunks = []
+        self.held = None
+
+    def write(self, text):
+        if self.held is not None:
+            self.held.append(text)
+        else:
+            self.chunks.append(text)
+
+    def clear(self):
+        self.write(TerminalOutput.clear_codes)
+
+    def hold(self):
+        self.held = []
+
+    def take(self):
+        text = ''.join(self.chunks)
+        self.chunks = []
+        return text
+
+
+class SessionInput(InputSource):
+    """Reads the lines a player has sent, without ever blocking.
+
+    If no line is waiting, InputPending is raised and the prompt is
+    kept so that it can be sent to the player.
+    """
+
+    def __init__(self, output):
+        self.lines = deque()
+        self.prompt = ''
+        self._output = output
+
+    def read_line(self, prompt):
+        held = self._output.held
+        if held is not None:
+            # First read of a turn played again. If it stops at the
+            # same prompt, the player saw everything up to here last
+            # time. If not, the turn went another way, so the player
+            # needs to see it, and their line answered a prompt that
+            # is gone.
+            self._output.held = None
+            if prompt != self.prompt:
+                self._output.chunks.extend(held)
+                if self.lines:
+                    self.lines.popleft()
+        if not self.lines:
+            self.prompt = prompt
+            raise InputPending()
+        return self.lines.popleft()
+
+
+class GameSession(asynchat.async_chat):
+    """One player's connection and game.
+
+    The dungeon is only generated once the player sends their first
+    line, so idle connections stay small. Each line is queued, then
+    turns are played until the game needs input that has not arrived.
+    That turn is abandoned and played again from the start once more
+    input comes in. Rooms only change the first time they are
+    entered, so this is harmless, and SessionOutput holds back what
+    the player has already seen.
+    """
+
+    def __init__(self, sock, size):
+        asynchat.async_chat.__init__(self, sock)
+        self.set_terminator('\n')
+        self.size = size
+        self.game = None
+        self._incoming = []
+        self._retrying = False
+        self.push("Welcome to the dungeon!\n>> PRESS RETURN")
+
+    def collect_incoming_data(self, data):
+        self._incoming.append(data)
+
+    def found_terminator(self):
+        line = ''.join(self._incoming).rstrip('\r')
+        self._incoming = []
+        if self.game is None:
+            self.start_game()
+        else:
+            self.source.lines.append(line)
+        self.play()
+
+    def start_game(self):
+        room_map = RoomEngine(self.size, 'sparse')
+        room_map = populate_map(build_map(room_map))
+        self.output = SessionOutput()
+        self.source = SessionInput(self.output)
+        # Levels are built as they are reached, so that many games
+        # do not all generate levels on threads of their own.
+        levels = LevelLoader(self.size, background=False)
+        self.game = GameEngine(self.source, self.output, levels)
+        self.game.setup(room_map)
+
+    def play(self):
+        """Plays turns until more input is needed or the game ends."""
+
+        try:
+            while True:
+                if self._retrying:
+                    self.output.hold()
+                try:
+                    self.game.turn()
+                    self._retrying = False
+                except InputPending:
+                    self._retrying = True
+                    break
+        except (SystemExit, EOFError):
+            # The hero died.
+            if self.output.held:
+                self.output.chunks.extend(self.output.held)
+                self.output.held = None
+            self.push(self.output.take())
+            self.close_when_done()
+            return
+        self.push(self.output.take() + self.source.prompt)
+
+
+class GameServer(asyncore.dispatcher):
+    """Accepts players and starts a GameSession for each."""
+
+    def __init__(self, host, port, size):
+        asyncore.dispatcher.__init__(self)
+        self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.set_reuse_addr()
+        self.bind((host, port))
+        self.listen(1024)
+        self.size = size
+
+    def handle_accept(self):
+        pair = self.accept()
+        if pair is not None:
+            GameSession(pair[0], self.size)
+
+
+def serve(host='127.0.0.1', port=4545, size=10):
+    """Runs the game server until interrupted."""
+
+    GameServer(host, port, size)
+    # poll() copes with far more connections than select().
+    asyncore.loop(use_poll=True)
+
+
+# Every response from the server ends in one of these prompts.
+PROMPTS = (">> ENTER CHOICE: ", ">> PRESS RETURN",
+           "You won! Press enter to continue.")
+
+
+class LoadClient(asynchat.async_chat):
+    """A bot player that sends random moves and times the replies."""
+
+    choices = ('0', '1', '2', '3', 'fight', 'flee', '')
+
+    def __init__(self, address, test):
+        asynchat.async_chat.__init__(self)
+        self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.connect(address)
+        self.set_terminator(None)
+        self.address = address
+        self.test = test
+        self.received = ''
+        self.sent_at = None
+
+    def collect_incoming_data(self, data):
+        # Only the tail of the reply is needed to spot the prompt.
+        self.received = (self.received + data)[-64:]
+        if self.received.endswith(PROMPTS):
+            self.received = ''
+            if self.sent_at is not None:
+                self.test.record(time.time() - self.sent_at)
+            self.send_move()
+
+    def send_move(self):
+        if self.test.moves_left <= 0:
+            self.close()
+            return
+        self.test.moves_left -= 1
+        self.sent_at = time.time()
+        self.push(random.choice(self.choices) + '\n')
+
+    def handle_close(self):
+        # The game ended; start a new one while moves remain.
+        self.close()
+        if self.test.moves_left > 0:
+            LoadClient(self.address, self.test)
+
+
+class LoadTest(object):
+    """Plays a number of moves over many concurrent bot sessions."""
+
+    def __init__(self, address, clients, moves):
+        self.address = address
+        self.clients = clients
+        self.moves_left = moves * clients
+        self.latencies = []
+
+    def record(self, latency):
+        self.latencies.append(latency)
+
+    def run(self):
+        """Plays every move and returns a dictionary of results."""
+
+        start = time.time()
+        for i in range(self.clients):
+            LoadClient(self.address, self)
+        asyncore.loop(use_poll=True)
+        elapsed = time.time() - start
+
+        latencies = sorted(self.latencies)
+        def percentile(p):
+            return latencies[min(len(latencies) - 1,
+                                 int(len(latencies) * p))] * 1e3
+        return {'clients': self.clients,
+                'moves': len(latencies),
+                'seconds': elapsed,
+                'moves_per_sec': len(latencies) / elapsed,
+                'p50_ms': percentile(0.50),
+                'p99_ms': percentile(0.99)}
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Host many games over TCP, or load test a host.")
+    commands = parser.add_subparsers(dest='command')
+
+    serve_parser = commands.add_parser('serve', help="run the game server")
+    serve_parser.add_argument('--host', default='127.0.0.1')
+    serve_parser.add_argument('--port', type=int, default=4545)
+    serve_parser.add_argument('--size', type=int, default=10,
+                              help="width of each player's map")
+
+    load_parser = commands.add_parser('load', help="load test a server")
+    load_parser.add_argument('--host', default='127.0.0.1')
+    load_parser.add_argument('--port', type=int, default=4545)
+    load_parser.add_argument('--clients', type=int, default=100)
+    load_parser.add_argument('--moves', type=int, default=100,
+                             help="moves to play per client")
+    args = parser.parse_args()
+
+    if args.command == 'serve':
+        serve(args.host, args.port, args.size)
+    else:
+        results = LoadTest((args.host, args.port), args.clients,
+                           args.moves).run()
+        print ("%(clients)d clients played %(moves)d moves in "
+               "%(seconds).2f seconds: %(moves_per_sec).0f moves/sec, "
+               "p50 %(p50_ms).2f ms, p99 %(p99_ms).2f ms" % results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""This file simulates fights between the hero and mobs of monsters in
+bulk, to help tune hero and monster stats without playing the game.
+Battles follow the same rules as FightEngine.battle(), but are run side
+by side with NumPy, one round at a time across all battles. It needs
+NumPy, which the game itself does not.
+
+    python ex45_sim.py 10 --battles 1000000
+"""
+
+import argparse
+import time
+import numpy
+from ex45_chars import Hero, GenericMonster
+
+
+class SimResult(object):
+    """The results of many simulated battles against one mob size.
+
+    won, hit_points and rounds are arrays with an entry per battle:
+    whether the hero won, the hit points the hero had left (0 when
+    the hero died) and the number of rounds fought.
+    """
+
+    def __init__(self, mob_size, won, hit_points, rounds):
+        self.mob_size = mob_size
+        self.won = won
+        self.hit_points = hit_points
+        self.rounds = rounds
+
+    def win_rate(self):
+        return self.won.mean()
+
+    def summary(self):
+        """Returns the headline numbers in a dictionary."""
+
+        hit_points = self.hit_points[self.won]
+        if not hit_points.size:
+            hit_points = numpy.zeros(1)
+        return {'mob_size': self.mob_size,
+                'battles': self.won.size,
+                'win_rate': float(self.win_rate()),
+                'hp_mean': float(hit_points.mean()),
+                'hp_p10': float(numpy.percentile(hit_points, 10)),
+                'hp_p50': float(numpy.percentile(hit_points, 50)),
+                'hp_p90': float(numpy.percentile(hit_points, 90)),
+                'rounds_mean': float(self.rounds.mean()),
+                'rounds_p90': float(numpy.percentile(self.rounds, 90))}
+
+
+def simulate(mob_size, battles, hero=None, monster=None, seed=None):
+    """Simulates battles between a hero and a mob of mob_size monsters.
+
+    hero and monster supply the attack ranges and starting hit points,
+    and default to a new Hero and GenericMonster. Returns a SimResult.
+    """
+
+    if hero is None:
+        hero = Hero()
+    if monster is None:
+        monster = GenericMonster(0)
+    rng = numpy.random.RandomState(seed)
+    (hero_low, hero_high) = hero.attack
+    (monster_low, monster_high) = monster.attack
+
+    hero_hp = numpy.full(battles, hero.hit_points, numpy.int64)
+    monster_hp = numpy.full((battles, mob_size), monster.hit_points,
+                            numpy.int64)
+    rounds = numpy.zeros(battles, numpy.int64)
+
+    # Only battles still being fought are worked on each round.
+    fighting = numpy.arange(battles)
+    while fighting.size:
+        count = fighting.size
+        hp = hero_hp[fighting]
+        mob = monster_hp[fighting]
+
+        # The hero hits one living monster, chosen at random.
+        keys = rng.random_sample((count, mob_size))
+        keys[mob <= 0] = -1
+        target = keys.argmax(axis=1)
+        mob[numpy.arange(count), target] -= rng.randint(hero_low,
+            hero_high + 1, count)
+
+        # Then every monster still alive hits the hero. Once the
+        # hero is dead, further hits only change how dead.
+        alive = mob > 0
+        hits = rng.randint(monster_low, monster_high + 1, (count, mob_size))
+        hp -= (hits * alive).sum(axis=1)
+
+        hero_hp[fighting] = hp
+        monster_hp[fighting] = mob
+        rounds[fighting] += 1
+        fighting = fighting[(hp > 0) & alive.any(axis=1)]
+
+    won = hero_hp > 0
+    return SimResult(mob_size, won, numpy.where(won, hero_hp, 0), rounds)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Simulate hero versus mob battles.")
+    parser.add_argument('max_mob', type=int, nargs='?', default=10,
+                        help="largest mob size to simulate (default: 10)")
+    parser.add_argument('--battles', type=int, default=100000,
+                        help="battles per mob size (default: 100000)")
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    print "%4s %8s %8s %8s %8s %8s %8s" % ('mob', 'win %', 'hp mean',
+        'hp p10', 'hp p50', 'hp p90', 'rounds')
+    start = time.time()
+    for mob_size in range(1, args.max_mob + 1):
+        result = simulate(mob_size, args.battles, seed=args.seed)
+        stats = result.summary()
+        print "%4d %8.2f %8.1f %8.0f %8.0f %8.0f %8.2f" % (mob_size,
+            stats['win_rate'] * 100, stats['hp_mean'], stats['hp_p10'],
+            stats['hp_p50'], stats['hp_p90'], stats['rounds_mean'])
+    print "%d battles in %.2f seconds" % (args.max_mob * args.battles,
+        time.time() - start)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,220 @@
+"""This file measures generated dungeons in bulk, to help tune map
+generation. Maps are generated, measured and written out one at a time,
+so any number of seeds can be measured in the same memory:
+
+    python ex45_stats.py 50 --seeds 0-49999 --out stats.csv
+    python ex45_stats.py 50 --seeds 0-9999 --format jsonl --processes 4
+    python ex45_stats.py 50 --min-rooms 5 --room-chance 0.45
+
+Each map gives one row of STAT_FIELDS, and a summary of every row is
+printed at the end, including how often each standard room type came
+up against its weight in RoomEngine._standard_rooms.
+"""
+
+import argparse
+import csv
+import json
+import sys
+from collections import OrderedDict
+from multiprocessing import Pool
+import ex45_grid
+from ex45_engines import RoomEngine
+from ex45_map import build_map
+from ex45_chars import populate_map
+from ex45_batch import parse_seeds
+
+
+STANDARD_TYPES = tuple(room_type
+                       for room_type, weight in RoomEngine._standard_rooms)
+STAT_FIELDS = (('seed', 'size', 'rooms', 'depth', 'doors', 'mean_degree',
+                'dead_ends', 'monsters') + STANDARD_TYPES)
+
+
+def map_stats(room_map):
+    """Measures a generated and populated room_map.
+
+    Returns a dictionary of STAT_FIELDS. depth is the number of moves
+    from the first room to the last, and mean_degree the mean number
+    of doors per room.
+    """
+
+    stats = dict.fromkeys(STANDARD_TYPES, 0)
+    rooms = doors = dead_ends = monsters = 0
+    for coord, cell in ex45_grid.real_cells(room_map):
+        rooms += 1
+        degree = bin(cell >> 4).count('1')
+        doors += degree
+        dead_ends += degree == 1
+        monsters += len(room_map.rooms[coord].monsters)
+        room_type = ex45_grid.ROOM_TYPES[cell & 0x0f]
+        if room_type in stats:
+            stats[room_type] += 1
+
+    routes = room_map.routes
+    stats.update(seed=room_map.seed, size=room_map.size, rooms=rooms,
+                 depth=routes.distance(room_map.init_coord,
+                                       routes.last_room()),
+                 doors=doors // 2,
+                 mean_degree=round(float(doors) / rooms, 3),
+                 dead_ends=dead_ends, monsters=monsters)
+    return stats
+
+
+def dungeon_stats(size, seed, min_rooms=None, room_chance=None):
+    """Generates and populates the dungeon for a seed, then measures
+    it with map_stats(). min_rooms and room_chance override those of
+    RoomEngine.
+    """
+
+    room_map = RoomEngine(size, 'sparse', seed)
+    if min_rooms is not None:
+        room_map.min_rooms = min_rooms
+    if room_chance is not None:
+        room_map.room_chance = room_chance
+    return map_stats(populate_map(build_map(room_map)))
+
+
+def _dungeon_stats(job):
+    # Pool workers take a single argument.
+    return dungeon_stats(*job)
+
+
+def stream_stats(size, seeds, min_rooms=None, room_chance=None,
+                 processes=1, chunksize=16):
+    """Yields the stats of the dungeon for each seed, in seed order.
+
+    With more than one process, dungeons are measured across a pool
+    of workers, and only a few chunks of results are held at once.
+    """
+
+    jobs = ((size, seed, min_rooms, room_chance) for seed in seeds)
+    if processes == 1:
+        for job in jobs:
+            yield _dungeon_stats(job)
+        return
+
+    pool = Pool(processes)
+    try:
+        for stats in pool.imap(_dungeon_stats, jobs, chunksize):
+            yield stats
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+class Summary(object):
+    """Running totals of a stream of map stats.
+
+    Only counts and sums are kept, so summarising any number of maps
+    takes the same memory.
+    """
+
+    def __init__(self):
+        self.maps = 0
+        self.totals = dict.fromkeys(STAT_FIELDS[2:], 0)
+        self.low = {}
+        self.high = {}
+
+    def add(self, stats):
+        self.maps += 1
+        for field in self.totals:
+            value = stats[field]
+            self.totals[field] += value
+            self.low[field] = min(self.low.get(field, value), value)
+            self.high[field] = max(self.high.get(field, value), value)
+
+    def mean(self, field):
+        return float(self.totals[field]) / self.maps if self.maps else 0.0
+
+    def type_mix(self):
+        """Returns (room type, share of rooms, share expected from its
+        weight) for each standard room type.
+        """
+
+        weights = dict(RoomEngine._standard_rooms)
+        total_weight = float(sum(weights.values()))
+        generated = sum(self.totals[room_type]
+                        for room_type in STANDARD_TYPES)
+        return [(room_type,
+                 self.totals[room_type] / float(generated) if generated
+                 else 0.0,
+                 weights[room_type] / total_weight)
+                for room_type in STANDARD_TYPES]
+
+    def report(self, out=sys.stdout):
+        """Writes the summary as a table to out."""
+
+        out.write("%d maps\n" % self.maps)
+        out.write("%-12s %10s %10s %10s\n" % ('', 'mean', 'min', 'max'))
+        for field in STAT_FIELDS[2:8]:
+            out.write("%-12s %10.2f %10s %10s\n" % (field, self.mean(field),
+                self.low.get(field), self.high.get(field)))
+        out.write("%-12s %10s %10s\n" % ('room type', 'share', 'weight'))
+        for room_type, share, expected in self.type_mix():
+            out.write("%-12s %9.1f%% %9.1f%%\n" % (room_type, share * 100,
+                                                   expected * 100))
+
+
+def write_csv(rows, out_file):
+    """Writes each row of stats to out_file as CSV, passing the rows
+    on as it goes.
+    """
+
+    writer = csv.DictWriter(out_file, STAT_FIELDS)
+    writer.writeheader()
+    for row in rows:
+        writer.writerow(row)
+        yield row
+
+
+def write_jsonl(rows, out_file):
+    """Writes each row of stats to out_file as a line of JSON,
+    passing the rows on as it goes.
+    """
+
+    for row in rows:
+        out_file.write(json.dumps(OrderedDict((field, row[field])
+                                              for field in STAT_FIELDS)))
+        out_file.write('\n')
+        yield row
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure generated dungeons in bulk.")
+    parser.add_argument('size', type=int, help="width of the square map")
+    parser.add_argument('--seeds', type=parse_seeds, default='0-999',
+                        help="seeds to measure, e.g. 0-999 or 1,5,9")
+    parser.add_argument('--out', default=None,
+                        help="file to write each map's stats to")
+    parser.add_argument('--format', default='csv', choices=('csv', 'jsonl'))
+    parser.add_argument('--processes', type=int, default=1,
+                        help="worker processes (default: 1)")
+    parser.add_argument('--min-rooms', type=int, default=None,
+                        help="rooms forced after the first (default: %d)"
+                             % RoomEngine.min_rooms)
+    parser.add_argument('--room-chance', type=float, default=None,
+                        help="chance of a room behind each open side "
+                             "(default: %s)" % RoomEngine.room_chance)
+    args = parser.parse_args()
+
+    rows = stream_stats(args.size, args.seeds, args.min_rooms,
+                        args.room_chance, args.processes)
+    out_file = None
+    if args.out:
+        out_file = open(args.out, 'wb')
+        writers = {'csv': write_csv, 'jsonl': write_jsonl}
+        rows = writers[args.format](rows, out_file)
+
+    summary = Summary()
+    try:
+        for row in rows:
+            summary.add(row)
+    finally:
+        if out_file is not None:
+            out_file.close()
+    summary.report()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,280 @@
+"""This file runs a fixed suite of benchmarks over every phase of the
+game, and keeps the results of each commit so that they can be
+compared:
+
+    python ex45_suite.py
+    python ex45_suite.py --compare 8a05500 --threshold 0.2
+
+Each case runs in its own process, so that the peak memory it reports
+is its own, along with how much the measured phase raised that peak.
+Results are saved to DIR/<commit>-<backend>.json, DIR being
+.ex45_bench by default. With --compare, any case that got slower or
+used more memory than the saved results by more than the threshold is
+flagged, and the exit status is 1.
+"""
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+from ex45_engines import RoomEngine, FightEngine
+from ex45_map import create_map, seed_map, generate_map, fill_empty_rooms
+from ex45_map import build_map, draw_map
+from ex45_chars import Hero, GenericMonster, populate_map
+from ex45_text import TerminalOutput
+
+
+# Every map is generated from this seed, which gives 308 rooms on
+# all but the smallest maps.
+SEED = 15
+
+
+def _blank_map(size, backend):
+    return create_map(RoomEngine(size, backend, SEED))
+
+
+# Each case sets up what it needs and returns a function running the
+# part to be measured.
+
+def case_create_map(size, backend):
+    room_map = RoomEngine(size, backend, SEED)
+    return lambda: create_map(room_map)
+
+
+def case_seed_map(size, backend):
+    room_map = _blank_map(size, backend)
+    return lambda: seed_map(room_map)
+
+
+def case_generate_map(size, backend):
+    room_map = seed_map(_blank_map(size, backend))
+    return lambda: generate_map(room_map)
+
+
+def case_fill_empty_rooms(size, backend):
+    # A blank map is the worst case: every cell gets filled.
+    room_map = _blank_map(size, backend)
+    return lambda: fill_empty_rooms(room_map)
+
+
+def case_populate_map(size, backend):
+    room_map = build_map(RoomEngine(size, backend, SEED))
+    return lambda: populate_map(room_map)
+
+
+def case_draw_map(size, backend):
+    room_map = build_map(RoomEngine(size, backend, SEED))
+    def draw():
+        with open(os.devnull, 'w') as null:
+            out = TerminalOutput(null)
+            draw_map(room_map, out)
+            out.flush()
+    return draw
+
+
+def case_add_room(count, backend):
+    # Rooms with two doors, laid out row by row on a large map.
+    room_map = _blank_map(1000, backend)
+    room_map.doors = [1, 2]
+    def add_rooms():
+        for i in xrange(count):
+            room_map.coord = (i % 1000, i // 1000)
+            room_map.add_room('generic', i + 1)
+    return add_rooms
+
+
+def case_pick_random_room(count, backend):
+    room_map = RoomEngine(10, seed=SEED)
+    def pick():
+        for i in xrange(count):
+            room_map._pick_random_room()
+    return pick
+
+
+def case_battle(mob_size, backend, fights=1000):
+    def battle():
+        for i in xrange(fights):
+            monsters = [GenericMonster(j) for j in range(mob_size)]
+            FightEngine.battle(Hero(), monsters, quiet=True)
+    return battle
+
+
+def case_startup(count, backend):
+    # Cold starts of a headless engine, each in a fresh interpreter.
+    command = [sys.executable, '-c', 'import ex45_engines; '
+               'ex45_engines.RoomEngine(10, %r)' % backend]
+    directory = os.path.dirname(os.path.abspath(__file__))
+    def start():
+        for i in xrange(count):
+            subprocess.check_call(command, cwd=directory)
+    return start
+
+
+# Each case is run once for each of its parameters: map sizes, room
+# or pick counts, or mob sizes.
+MAP_SIZES = (100, 300, 1000)
+SUITE = (('create_map', case_create_map, MAP_SIZES),
+         ('seed_map', case_seed_map, MAP_SIZES),
+         ('generate_map', case_generate_map, MAP_SIZES),
+         ('fill_empty_rooms', case_fill_empty_rooms, MAP_SIZES),
+         ('populate_map', case_populate_map, MAP_SIZES),
+         ('draw_map', case_draw_map, (100, 300)),
+         ('add_room', case_add_room, (10000, 100000)),
+         ('pick_random_room', case_pick_random_room, (100000, 1000000)),
+         ('battle', case_battle, (1, 3, 10)),
+         ('startup', case_startup, (10,)))
+CASES = dict((name, case) for name, case, params in SUITE)
+
+
+def _peak_kb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def run_case(name, param, backend, repeat):
+    """Runs one case in this process.
+
+    Returns the best time of repeat runs, the peak memory of the
+    process in kilobytes and how far the measured part raised that
+    peak.
+    """
+
+    seconds = None
+    phase = 0
+    for i in range(repeat):
+        run = CASES[name](param, backend)
+        before = _peak_kb()
+        start = time.time()
+        run()
+        elapsed = time.time() - start
+        phase = max(phase, _peak_kb() - before)
+        seconds = elapsed if seconds is None else min(seconds, elapsed)
+    return {'seconds': seconds, 'peak_kb': _peak_kb(), 'phase_kb': phase}
+
+
+def run_suite(backend='dict', repeat=3, quick=False, out=sys.stdout):
+    """Runs every case in a process of its own.
+
+    With quick, only the smallest parameter of each case is run.
+    Returns a dictionary of results keyed by 'name/param'.
+    """
+
+    results = {}
+    out.write("%-24s %12s %13s %13s\n" % ('case', 'time', 'peak', 'phase'))
+    for name, case, params in SUITE:
+        for param in params[:1] if quick else params:
+            command = [sys.executable, os.path.abspath(__file__), '--case',
+                       name, str(param), '--backend', backend,
+                       '--repeat', str(repeat)]
+            result = json.loads(subprocess.check_output(command))
+            key = "%s/%d" % (name, param)
+            results[key] = result
+            out.write("%-24s %10.4f s %10d KB %10d KB\n" % (key,
+                result['seconds'], result['peak_kb'], result['phase_kb']))
+            out.flush()
+    return results
+
+
+def commit_name():
+    """Returns the short hash of the commit checked out where the game
+    lives, or 'local' outside a git checkout.
+    """
+
+    directory = os.path.dirname(os.path.abspath(__file__))
+    try:
+        with open(os.devnull, 'w') as null:
+            return subprocess.check_output(
+                ['git', 'rev-parse', '--short', 'HEAD'],
+                stderr=null, cwd=directory).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'local'
+
+
+# Times under this many seconds are too short to compare.
+MIN_SECONDS = 0.001
+
+
+def compare(results, baseline, threshold, out=sys.stdout):
+    """Writes how results changed from baseline, flagging those worse
+    by more than threshold, a fraction. Returns the flagged keys.
+    """
+
+    regressions = []
+    out.write("%-24s %10s %10s\n" % ('', 'time', 'peak'))
+    for key in sorted(results):
+        if key not in baseline:
+            continue
+        changes = []
+        flagged = False
+        for field in ('seconds', 'peak_kb'):
+            old = baseline[key][field]
+            change = (results[key][field] - old) / float(old) if old else 0.0
+            changes.append("%+9.1f%%" % (change * 100))
+            if field == 'seconds' and old < MIN_SECONDS:
+                continue
+            flagged = flagged or change > threshold
+        out.write("%-24s %s %s%s\n" % (key, changes[0], changes[1],
+                                       '  REGRESSION' if flagged else ''))
+        if flagged:
+            regressions.append(key)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run the benchmark suite and compare commits.")
+    parser.add_argument('--backend', default='dict',
+                        choices=('dict', 'compact', 'sparse'),
+                        help="map backend to benchmark (default: dict)")
+    parser.add_argument('--repeat', type=int, default=3,
+                        help="runs of each case, keeping the fastest")
+    parser.add_argument('--quick', action='store_true',
+                        help="only run the smallest size of each case")
+    parser.add_argument('--dir', default='.ex45_bench',
+                        help="where results are kept (default: .ex45_bench)")
+    parser.add_argument('--compare', metavar='COMMIT', default=None,
+                        help="compare with the results saved for COMMIT, "
+                             "or with a results file")
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help="flag cases worse by more than this fraction")
+    parser.add_argument('--case', nargs=2, default=None,
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.case:
+        # Run a single case for run_suite(), in this process.
+        (name, param) = args.case
+        print json.dumps(run_case(name, int(param), args.backend,
+                                  args.repeat))
+        return
+
+    # Read the baseline first, in case it is about to be replaced.
+    baseline = None
+    if args.compare:
+        baseline_path = args.compare
+        if not os.path.exists(baseline_path):
+            baseline_path = os.path.join(args.dir, "%s-%s.json" % (
+                args.compare, args.backend))
+        with open(baseline_path) as baseline_file:
+            baseline = json.load(baseline_file)['results']
+
+    results = run_suite(args.backend, args.repeat, args.quick)
+
+    if not os.path.isdir(args.dir):
+        os.makedirs(args.dir)
+    commit = commit_name()
+    path = os.path.join(args.dir, "%s-%s.json" % (commit, args.backend))
+    with open(path, 'w') as results_file:
+        json.dump({'commit': commit, 'backend': args.backend,
+                   'python': sys.version.split()[0], 'time': time.time(),
+                   'results': results}, results_file, indent=1,
+                  sort_keys=True)
+    print "Saved results to %s" % path
+
+    if baseline is not None and compare(results, baseline, args.threshold):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
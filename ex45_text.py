@@ -4,46 +4,197 @@ text output and input.
 """
 
 import os
-import textwrap
+import sys
 
-def clear():
+
+class OutputSink(object):
+    """Parent class for the places game output can go.
+
+    Subclasses provide write(), and may buffer what is written until
+    flush() is called. say() writes its arguments on a line, the way
+    the print statement would.
+    """
+
+    def write(self, text):
+        raise NotImplementedError
+
+    def say(self, *items):
+        self.write(' '.join([str(item) for item in items]) + '\n')
+
+    def clear(self):
+        pass
+
+    def flush(self):
+        pass
+
+
+class TerminalOutput(OutputSink):
+    """Writes output to the terminal a whole screen at a time.
+
+    Output is buffered until flush(), so each turn reaches the
+    terminal in a single write. The screen is cleared with ANSI
+    escape codes rather than by running a clear command.
+    """
+
+    clear_codes = '\x1b[2J\x1b[H'
+
+    def __init__(self, stream=None):
+        self.stream = stream if stream is not None else sys.stdout
+        self._buffer = []
+
+    def write(self, text):
+        self._buffer.append(text)
+
+    def clear(self):
+        # Anything still buffered would be wiped straight away.
+        if os.name == 'nt':
+            self._buffer = []
+            os.system('cls')
+        else:
+            self._buffer = [self.clear_codes]
+
+    def flush(self):
+        if self._buffer:
+            self.stream.write(''.join(self._buffer))
+            self._buffer = []
+        self.stream.flush()
+
+
+class CaptureOutput(OutputSink):
+    """Keeps all output in memory, for headless games and checks."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, text):
+        self._chunks.append(text)
+
+    def getvalue(self):
+        return ''.join(self._chunks)
+
+
+class NullOutput(OutputSink):
+    """Throws all output away."""
+
+    def write(self, text):
+        pass
+
+
+# The terminal, used unless another sink is given.
+screen = TerminalOutput()
+
+
+def clear(out=screen):
     """This function clears the screen regardless of OS."""
-    os.system('cls' if os.name == 'nt' else 'clear')
+    out.clear()
     return
 
 
-def newline():
+def newline(out=screen):
     """Just wanted a way not to type backslash."""
-    print "\n"
+    out.write("\n\n")
     return
 
-def wrapit(input_text):
+def wrapit(input_text, out=screen):
     """Uses textwrap.py to format paragraphs neatly.
     Textwrap outputs an array of lines to be printed.
     Print array entries individually and finish with a new line.
     """
 
+    import textwrap
+
     # Replaced whitespace so that \n would be left behind.
     wrapped = textwrap.wrap(input_text, width=60, replace_whitespace=True)
     for line in wrapped:
-        print line
-    newline()
+        out.say(line)
+    newline(out)
     return
 
-def carriage_return():
+class InputSource(object):
+    """Parent class for the places player input can come from.
+
+    Subclasses only need to provide read_line(), which returns one
+    line of input for a prompt and raises EOFError when there is no
+    more input to be had. If the source has an output sink, it is
+    flushed before every read, so the player sees everything up to
+    the prompt.
+    """
+
+    output = None
+
+    def read_line(self, prompt):
+        raise NotImplementedError
+
+    def _read(self, prompt):
+        if self.output is not None:
+            self.output.flush()
+        return self.read_line(prompt)
+
+    def get_line(self, prompt=">> PRESS RETURN"):
+        """Returns a line of input, which may be empty."""
+        return self._read(prompt)
+
+    def get_input(self, prompt=">> ENTER CHOICE: "):
+        """Returns the next non-empty response as a lowercase string."""
+        while True:
+            response = self._read(prompt)
+            if response != '':
+                return response.lower()
+
+
+class InteractiveInput(InputSource):
+    """Reads input typed by the player at the terminal."""
+
+    def __init__(self, output=screen):
+        self.output = output
+
+    def read_line(self, prompt):
+        return raw_input(prompt)
+
+
+class ScriptedInput(InputSource):
+    """Reads input from a list of lines or an open file, without
+    blocking, for scripted and headless games.
+    """
+
+    def __init__(self, lines, output=None):
+        self._lines = iter(lines)
+        self.output = output
+
+    def read_line(self, prompt):
+        try:
+            return next(self._lines).rstrip('\r\n')
+        except StopIteration:
+            raise EOFError("End of script")
+
+
+class CallbackInput(InputSource):
+    """Asks a function for input, so that a program can play the game.
+
+    The callback is given the prompt and returns the response.
+    """
+
+    def __init__(self, callback, output=None):
+        self.callback = callback
+        self.output = output
+
+    def read_line(self, prompt):
+        return self.callback(prompt)
+
+
+# Input typed at the terminal, used unless another source is given.
+interactive = InteractiveInput()
+
+
+def carriage_return(source=interactive):
     """Waits for user to "scroll" the screen by way of clearing it."""
-    raw_input(">> PRESS RETURN")
+    source.get_line(">> PRESS RETURN")
     clear()
     return
 
-def get_input():
+def get_input(source=interactive):
     """Grabs user input and returns it as a lowercase string.
        Null responses are disallowed.
     """
 
-    response = raw_input(">> ENTER CHOICE: ")
-    if response == '':
-        response = get_input()
-    return response.lower()
-
-
+    return source.get_input()